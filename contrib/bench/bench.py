@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2017 Adrián López Tejedor <adrianlzt@gmail.com>
+#                  Óscar García Amor <ogarcia@connectical.com>
+#
+# Distributed under terms of the GNU GPLv3 license.
+
+"""
+Benchmark vaultcli commands against an in-process fake Vaultier server
+
+For every scale a fake server is started and filled with a synthetic
+workspace, then tree-workspace, export-workspace, import-workspace and
+show-secret are run in this same process and their time and number of API
+requests are reported.
+"""
+
+from fake_vaultier import FakeVaultier, generate_dataset
+from vaultcli import main as vaultcli_main
+
+from Cryptodome.PublicKey import RSA
+from contextlib import redirect_stdout
+from tabulate import tabulate
+from zipfile import ZipFile
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+COMMANDS = ('tree', 'export', 'import', 'show')
+
+def parse_scale(scale):
+    try:
+        vaults, cards, secrets = [int(n) for n in scale.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('scale must be VAULTSxCARDSxSECRETS, like 2x5x10')
+    return vaults, cards, secrets
+
+def parse_sizes(sizes):
+    try:
+        minimum, maximum = [int(n) for n in sizes.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('file sizes must be MIN,MAX in bytes')
+    return minimum, maximum
+
+def write_config(directory, server, key):
+    key_file = os.path.join(directory, 'vaultier.key')
+    with open(key_file, 'w') as file:
+        file.write(key)
+    config_file = os.path.join(directory, 'vaultcli.conf')
+    with open(config_file, 'w') as file:
+        file.write('[DEFAULT]\nemail = bench@example.com\nserver = {}\nkey = {}\n'.format(server.url, key_file))
+    return config_file
+
+def run(server, config_file, *argv):
+    """
+    Run a vaultcli command and measure it
+
+    :return: seconds, requests by endpoint and error (None if successful)
+    :rtype: tuple
+    """
+    server.reset_stats()
+    error = None
+    sys.argv = ['vaultcli', '-c', config_file] + [str(arg) for arg in argv]
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            vaultcli_main.main()
+    except SystemExit as e:
+        if e.code:
+            error = str(e.code).splitlines()[0]
+    return time.perf_counter() - start, server.stats(), error
+
+def bench_scale(scale, key, args):
+    vaults, cards, secrets = scale
+    server = FakeVaultier().start()
+    results = []
+    try:
+        workspace = generate_dataset(server, key, vaults, cards, secrets, args.file_ratio, args.file_sizes, args.seed)
+        server.latency, server.jitter, server.error_rate = args.latency, args.jitter, args.error_rate
+        total = vaults * cards * secrets
+        with tempfile.TemporaryDirectory() as directory:
+            config_file = write_config(directory, server, key)
+            runs = []
+            if 'tree' in args.commands:
+                runs.append(('tree-workspace', total, ('tree-workspace', workspace['id'])))
+            if 'export' in args.commands or 'import' in args.commands:
+                runs.append(('export-workspace', total, ('export-workspace', workspace['id'], directory, '-f', 'export')))
+            if 'show' in args.commands:
+                sample = random.Random(args.seed).sample(sorted(server.secrets), min(args.show_samples, len(server.secrets)))
+                runs.append(('show-secret', len(sample), None))
+            for name, count, argv in runs:
+                if argv:
+                    seconds, requests, error = run(server, config_file, *argv)
+                else:
+                    seconds, requests, error = 0, {}, None
+                    for secret_id in sample:
+                        secret_seconds, secret_requests, error = run(server, config_file, 'show-secret', secret_id)
+                        seconds += secret_seconds
+                        for endpoint, value in secret_requests.items():
+                            requests[endpoint] = requests.get(endpoint, 0) + value
+                        if error: break
+                results.append(result(scale, name, count, seconds, requests, error))
+                if name == 'export-workspace' and 'import' in args.commands and not error:
+                    with ZipFile(os.path.join(directory, 'export.zip')) as zipfile:
+                        zipfile.extractall(os.path.join(directory, 'import'))
+                    import_file = os.path.join(directory, 'import', '{}.json'.format(workspace['name']))
+                    seconds, requests, error = run(server, config_file, 'import-workspace', import_file, '-j', args.jobs)
+                    results.append(result(scale, 'import-workspace', total, seconds, requests, error))
+    finally:
+        server.stop()
+    return [r for r in results if r['command'].split('-')[0] in args.commands]
+
+def result(scale, command, count, seconds, requests, error):
+    return {
+            'scale': 'x'.join(str(n) for n in scale),
+            'command': command,
+            'secrets': count,
+            'seconds': round(seconds, 3),
+            'secrets_per_second': round(count / seconds, 1) if seconds else None,
+            'requests': requests.get('total', 0),
+            'requests_by_endpoint': {endpoint: value for endpoint, value in sorted(requests.items()) if endpoint != 'total'},
+            'error': error
+           }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark vaultcli against a fake Vaultier server.')
+    parser.add_argument('-s', '--scales', metavar='scales', type=lambda scales: [parse_scale(s) for s in scales.split(',')], default=[(2, 5, 10)], help='comma separated VAULTSxCARDSxSECRETS list (default 2x5x10)')
+    parser.add_argument('-c', '--commands', metavar='commands', type=lambda commands: commands.split(','), default=list(COMMANDS), help='comma separated list of {} (default all)'.format(', '.join(COMMANDS)))
+    parser.add_argument('-l', '--latency', metavar='seconds', type=float, default=0, help='latency added to every request')
+    parser.add_argument('--jitter', metavar='seconds', type=float, default=0, help='maximum random latency added to every request')
+    parser.add_argument('-e', '--error-rate', metavar='rate', type=float, default=0, help='fraction of requests answered with an error')
+    parser.add_argument('--file-ratio', metavar='rate', type=float, default=0.1, help='fraction of secrets that are files (default 0.1)')
+    parser.add_argument('--file-sizes', metavar='min,max', type=parse_sizes, default=(1024, 65536), help='attached file sizes in bytes (default 1024,65536)')
+    parser.add_argument('--show-samples', metavar='n', type=int, default=20, help='number of secrets read with show-secret (default 20)')
+    parser.add_argument('-j', '--jobs', metavar='jobs', type=int, default=4, help='jobs used by import-workspace (default 4)')
+    parser.add_argument('--seed', metavar='seed', type=int, default=0, help='seed of the synthetic dataset')
+    parser.add_argument('-o', '--output', metavar='file', help='write results also as JSON to this file')
+    args = parser.parse_args()
+
+    unknown = set(args.commands) - set(COMMANDS)
+    if unknown:
+        parser.error('unknown commands: {}'.format(', '.join(sorted(unknown))))
+
+    key = RSA.generate(2048).exportKey().decode()
+    argv = sys.argv
+    results = []
+    for scale in args.scales:
+        results.extend(bench_scale(scale, key, args))
+    sys.argv = argv
+
+    table = [[r['scale'], r['command'], r['secrets'], r['seconds'], r['secrets_per_second'], r['requests'], r['error'] or ''] for r in results]
+    print(tabulate(table, headers=['Scale', 'Command', 'Secrets', 'Seconds', 'Secrets/s', 'Requests', 'Error'], tablefmt='rst'))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2017 Adrián López Tejedor <adrianlzt@gmail.com>
+#                  Óscar García Amor <ogarcia@connectical.com>
+#
+# Distributed under terms of the GNU GPLv3 license.
+
+"""
+In-process fake Vaultier server
+
+Implements the part of the Vaultier REST API used by vaultcli (auth,
+server-time, workspaces, workspace_keys, vaults, cards, secrets and
+secret_blobs) keeping everything in memory. Requests can be delayed and can
+fail randomly to test how vaultcli behaves with slow or unstable servers.
+"""
+
+from vaultcli.cypher import Cypher
+
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import datetime
+import itertools
+import json
+import random
+import threading
+import time
+
+class FakeVaultier(object):
+    """
+    Fake Vaultier server running in a thread
+
+    :param latency: seconds added to every request
+    :param jitter: maximum random seconds added to latency
+    :param error_rate: probability of answering a request with HTTP 503
+    """
+    def __init__(self, latency=0, jitter=0, error_rate=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.workspaces = {}
+        self.vaults = {}
+        self.cards = {}
+        self.secrets = {}
+        self.blobs = {}
+        self.requests = Counter()
+        self.httpd = ThreadingHTTPServer((host, port), self.handler())
+        self.httpd.daemon_threads = True
+        self.url = 'http://{}:{}'.format(*self.httpd.server_address)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = Counter()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.requests)
+
+    def next_id(self):
+        with self.lock:
+            return next(self.ids)
+
+    def add_workspace(self, name, workspace_key=None, description=None):
+        workspace_id = self.next_id()
+        self.workspaces[workspace_id] = {
+                'id': workspace_id,
+                'slug': slug(name),
+                'name': name,
+                'description': description,
+                'membership': {'id': workspace_id, 'workspace_key': workspace_key}
+                                        }
+        return self.workspaces[workspace_id]
+
+    def add_vault(self, workspace_id, name, description=None, color='blue'):
+        vault_id = self.next_id()
+        self.vaults[vault_id] = {'id': vault_id, 'slug': slug(name), 'name': name, 'description': description, 'color': color, 'workspace': workspace_id}
+        return self.vaults[vault_id]
+
+    def add_card(self, vault_id, name, description=None):
+        card_id = self.next_id()
+        self.cards[card_id] = {'id': card_id, 'slug': slug(name), 'name': name, 'description': description, 'vault': vault_id}
+        return self.cards[card_id]
+
+    def add_secret(self, card_id, name, type, data, blob_meta=None):
+        secret_id = self.next_id()
+        self.secrets[secret_id] = {'id': secret_id, 'type': type, 'name': name, 'data': data, 'blob_meta': blob_meta, 'card': card_id}
+        return self.secrets[secret_id]
+
+    def route(self, method, path, query, body, content_type):
+        """
+        Returns (status, JSON object) for an API request
+        """
+        parts = [part for part in path.split('/') if part]
+        if len(parts) < 2 or parts[0] != 'api':
+            return 404, {'detail': 'Not found'}
+        resource = parts[1]
+        object_id = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else None
+        if resource == 'server-time':
+            return 200, {'datetime': datetime.datetime.utcnow().isoformat()}
+        if resource == 'auth':
+            return 200, {'token': 'fake-token'}
+        if resource == 'workspace_keys' and method == 'PUT':
+            workspace = self.workspaces[object_id]
+            workspace['membership']['workspace_key'] = json.loads(body)['workspace_key']
+            return 200, {'id': object_id, 'workspace_key': workspace['membership']['workspace_key'], 'workspace': workspace}
+        if resource == 'secret_blobs':
+            if method == 'GET':
+                return 200, {'id': object_id, 'blob_data': self.blobs.get(object_id)}
+            fields = parse_multipart(body, content_type)
+            self.blobs[object_id] = fields['blob_data'].decode()
+            self.secrets[object_id]['blob_meta'] = fields['blob_meta'].decode()
+            return 200, {'id': object_id}
+        collections = {'workspaces': self.workspaces, 'vaults': self.vaults, 'cards': self.cards, 'secrets': self.secrets}
+        parents = {'vaults': 'workspace', 'cards': 'vault', 'secrets': 'card'}
+        if resource not in collections:
+            return 404, {'detail': 'Not found'}
+        collection = collections[resource]
+        if object_id != None and object_id not in collection:
+            return 404, {'detail': 'Not found'}
+        if method == 'GET':
+            if object_id != None:
+                return 200, collection[object_id]
+            if resource in parents:
+                parent_id = int(query[parents[resource]][0])
+                return 200, [obj for obj in list(collection.values()) if obj[parents[resource]] == parent_id]
+            return 200, list(collection.values())
+        if method == 'POST':
+            data = json.loads(body)
+            if resource == 'workspaces':
+                return 201, self.add_workspace(data['name'], description=data.get('description'))
+            if resource == 'vaults':
+                return 201, self.add_vault(int(data['workspace']), data['name'], data.get('description'), data.get('color', 'blue'))
+            if resource == 'cards':
+                return 201, self.add_card(int(data['vault']), data['name'], data.get('description'))
+            return 201, self.add_secret(int(data['card']), data['name'], data['type'], data.get('data'))
+        if method in ('PUT', 'PATCH'):
+            data = json.loads(body)
+            data.pop('id', None)
+            data.pop('membership', None)
+            collection[object_id].update(data)
+            return 200, collection[object_id]
+        if method == 'DELETE':
+            self.delete(resource, object_id)
+            return 204, None
+        return 405, {'detail': 'Method not allowed'}
+
+    def delete(self, resource, object_id):
+        children = {'workspaces': ('vaults', 'workspace'), 'vaults': ('cards', 'vault'), 'cards': ('secrets', 'card')}
+        collections = {'workspaces': self.workspaces, 'vaults': self.vaults, 'cards': self.cards, 'secrets': self.secrets}
+        collections[resource].pop(object_id, None)
+        self.blobs.pop(object_id, None) if resource == 'secrets' else None
+        if resource in children:
+            child_resource, field = children[resource]
+            for child in [obj for obj in list(collections[child_resource].values()) if obj[field] == object_id]:
+                self.delete(child_resource, child['id'])
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle_request(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                resource = [part for part in url.path.split('/') if part][1:2]
+                with server.lock:
+                    server.requests['{} {}'.format(self.command, resource[0] if resource else '')] += 1
+                    server.requests['total'] += 1
+                delay = server.latency + random.uniform(0, server.jitter)
+                if delay:
+                    time.sleep(delay)
+                if server.error_rate and random.random() < server.error_rate:
+                    status, obj = 503, {'detail': 'Injected error'}
+                else:
+                    try:
+                        status, obj = server.route(self.command, url.path, parse_qs(url.query), body, self.headers.get('Content-Type', ''))
+                    except (KeyError, ValueError) as e:
+                        status, obj = 400, {'detail': str(e)}
+                payload = b'' if obj == None else json.dumps(obj).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+        return Handler
+
+def slug(name):
+    return '-'.join(str(name).lower().split())
+
+def parse_multipart(body, content_type):
+    """
+    Returns the fields of a multipart/form-data body
+
+    :rtype: dict of bytes
+    """
+    message = BytesParser(policy=HTTP).parsebytes('Content-Type: {}\r\n\r\n'.format(content_type).encode() + body)
+    return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True) for part in message.iter_parts()}
+
+def generate_dataset(server, key, vaults=2, cards=5, secrets=10, file_ratio=0.1, file_sizes=(1024, 65536), seed=0):
+    """
+    Fill a fake server with a workspace of synthetic secrets
+
+    Secrets are encrypted with a workspace key that is encrypted with the
+    given RSA key, as a real server would have them.
+
+    :param key: ascii RSA private key of the user
+    :param vaults: number of vaults
+    :param cards: number of cards in each vault
+    :param secrets: number of secrets in each card
+    :param file_ratio: fraction of secrets that are files
+    :param file_sizes: (min, max) size of attached files, sizes follow a
+        log-uniform distribution between them
+    :return: the workspace
+    :rtype: dict
+    """
+    rand = random.Random(seed)
+    cypher = Cypher(key)
+    workspace_key = cypher.gen_workspace_key()
+    workspace = server.add_workspace('Benchmark {}x{}x{}'.format(vaults, cards, secrets), workspace_key, 'Synthetic dataset')
+    for vault_index in range(vaults):
+        vault = server.add_vault(workspace['id'], 'Vault {}'.format(vault_index), color=rand.choice(['blue', 'orange', 'purple', 'green', 'red']))
+        for card_index in range(cards):
+            card = server.add_card(vault['id'], 'Card {}'.format(card_index), 'Card {} of vault {}'.format(card_index, vault_index))
+            for secret_index in range(secrets):
+                name = 'Secret {}'.format(secret_index)
+                if rand.random() < file_ratio:
+                    data = {'url': '', 'username': '', 'password': '', 'note': 'File {}'.format(secret_index)}
+                    secret = server.add_secret(card['id'], name, 300, cypher.encrypt(workspace_key, json.dumps(data)))
+                    size = int(file_sizes[0] * (file_sizes[1] / file_sizes[0]) ** rand.random())
+                    filedata = {'filedata': str(bytes(rand.getrandbits(8) for _ in range(size)), 'iso-8859-1')}
+                    filemeta = {'filename': 'file-{}.bin'.format(secret['id']), 'filesize': size, 'filetype': 'application/octet-stream'}
+                    server.blobs[secret['id']] = cypher.encrypt(workspace_key, json.dumps(filedata))
+                    secret['blob_meta'] = cypher.encrypt(workspace_key, json.dumps(filemeta))
+                elif rand.random() < 0.2:
+                    data = {'note': 'Note {} of card {}'.format(secret_index, card_index)}
+                    server.add_secret(card['id'], name, 100, cypher.encrypt(workspace_key, json.dumps(data)))
+                else:
+                    data = {
+                            'url': 'https://host{}.example.com'.format(secret_index),
+                            'username': 'user{}'.format(secret_index),
+                            'password': '{:032x}'.format(rand.getrandbits(128)),
+                            'note': ''
+                           }
+                    server.add_secret(card['id'], name, 200, cypher.encrypt(workspace_key, json.dumps(data)))
+    return workspace
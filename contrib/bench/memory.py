@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2017 Adrián López Tejedor <adrianlzt@gmail.com>
+#                  Óscar García Amor <ogarcia@connectical.com>
+#
+# Distributed under terms of the GNU GPLv3 license.
+
+"""
+Measure memory used by each vaultcli model object
+
+Objects are built with from_json from API-like data and kept alive, and
+the memory allocated while building them is divided by their number. The
+API data itself is not counted.
+"""
+
+from vaultcli.workspace import Workspace
+from vaultcli.vault import Vault
+from vaultcli.card import Card
+from vaultcli.secret import Secret
+
+from tabulate import tabulate
+
+import argparse
+import gc
+import tracemalloc
+
+def api_data(n):
+    """Returns API-like JSON objects for every model"""
+    return {
+            Workspace: [{'id': i, 'slug': 'workspace-{}'.format(i), 'name': 'Workspace {}'.format(i), 'description': 'Description', 'membership': {'id': i, 'workspace_key': 'k' * 344}} for i in range(n)],
+            Vault: [{'id': i, 'slug': 'vault-{}'.format(i), 'name': 'Vault {}'.format(i), 'description': 'Description', 'color': 'blue', 'workspace': 1} for i in range(n)],
+            Card: [{'id': i, 'slug': 'card-{}'.format(i), 'name': 'Card {}'.format(i), 'description': 'Description', 'vault': 1} for i in range(n)],
+            Secret: [{'id': i, 'type': 200, 'name': 'Secret {}'.format(i), 'data': 'd' * 152, 'blob_meta': None, 'card': 1} for i in range(n)]
+           }
+
+def measure(model, objects):
+    """
+    Returns bytes allocated per object built from objects
+
+    :rtype: float
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    instances = [model.from_json(obj) for obj in objects]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    # The list holding the instances is not part of their size
+    used -= instances.__sizeof__()
+    return used / len(instances)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure memory used by vaultcli models.')
+    parser.add_argument('-n', '--number', metavar='n', type=int, default=100000, help='number of objects of each model (default 100000)')
+    args = parser.parse_args()
+
+    data = api_data(args.number)
+    table = [[model.__name__, round(measure(model, objects), 1)] for model, objects in data.items()]
+    print(tabulate(table, headers=['Model', 'Bytes per object'], tablefmt='rst'))
+
+if __name__ == '__main__':
+    main()
@@ -32,9 +32,16 @@ import stat
 import logging
 import errno
 import llfuse
+import itertools
 import json
+import requests
+import threading
+import time
 from vaultcli import main as vault_main
-from functools import lru_cache
+from vaultcli.exceptions import ResourceUnavailable
+from vaultcli.secret import Secret
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import faulthandler
@@ -45,27 +52,366 @@ else:
 
 log = logging.getLogger(__name__)
 
-WORKSPACE_BASE_INODO = 100000
-VAULT_BASE_INODO = 200000
-CARD_BASE_INODO = 300000
-SECRET_BASE_INODO = 400000
+# Los 8 bits altos del inodo indican el tipo de elemento y los 56 bajos su id
+INODE_TAG_SHIFT = 56
+INODE_TAGS = {
+        'workspace': 1,
+        'vault': 2,
+        'card': 3,
+        'secret': 4,
+        'attachment': 5,
+        'new': 6
+        }
+
+# Tipos de inodo que son ficheros
+FILE_KINDS = ('secret', 'attachment', 'new')
+
+# Tipo de elemento que contiene cada tipo de directorio
+CHILD_KIND = {'root': 'workspace', 'workspace': 'vault', 'vault': 'card', 'card': 'secret'}
+
+# Valores por defecto de las caches (segundos y bytes)
+ATTR_TTL = 30
+CONTENT_TTL = 60
+CACHE_SIZE = 64 * 1024 * 1024
+
+# Los ficheros adjuntos se guardan en la cache de contenidos en trozos de este tamaño
+CHUNK_SIZE = 128 * 1024
+
+# Hilos atendiendo peticiones del kernel
+WORKERS = 8
+
+# Segundos sin escrituras tras los que se envian los cambios de un fichero
+WRITEBACK_DELAY = 2
+
+# Cada cuantos segundos se revalidan los directorios usados en los ultimos
+# REFRESH_WINDOW segundos
+REFRESH_INTERVAL = 10
+REFRESH_WINDOW = 300
+
+# Entrada de la tabla de inodos
+Node = namedtuple('Node', ['kind', 'id', 'parent'])
+
+# Listado de un directorio: lista de (name, inode) e indice name -> inode
+Listing = namedtuple('Listing', ['entries', 'index'])
+
+def make_inode(kind, id):
+    """Retorna el inodo de un elemento, unico para cada tipo e id"""
+    return (INODE_TAGS[kind] << INODE_TAG_SHIFT) | id
+
+class TTLCache(object):
+    """
+    Cache en la que cada entrada caduca 'ttl' segundos despues de guardarse
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.data = {}
+        self.next_purge = 1024
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Retorna el valor guardado, o None si no existe o ha caducado"""
+        item = self.data.get(key)
+        if item == None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def set(self, key, value):
+        with self.lock:
+            if len(self.data) >= self.next_purge:
+                self.purge()
+            self.data[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def peek(self, key):
+        """Retorna el valor guardado aunque haya caducado"""
+        item = self.data.get(key)
+        return None if item == None else item[1]
+
+    def invalidate(self, key):
+        self.data.pop(key, None)
+
+    def purge(self):
+        """Elimina las entradas caducadas (se llama con el lock tomado)"""
+        now = time.monotonic()
+        for key in [key for key, item in list(self.data.items()) if item[0] < now]:
+            self.data.pop(key, None)
+        self.next_purge = max(1024, len(self.data) * 2)
+
+class ContentCache(object):
+    """
+    Cache LRU de contenidos limitada por su tamaño total en bytes
+    Cada entrada caduca ademas 'ttl' segundos despues de guardarse
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item == None:
+                return None
+            if item[0] < time.monotonic():
+                self.remove(key)
+                return None
+            self.data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.remove(key)
+            # Lo que no cabe en la cache no se guarda
+            if len(value) > self.max_size:
+                return value
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, (_, old_value) = self.data.popitem(last=False)
+                self.size -= len(old_value)
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.remove(key)
+
+    def remove(self, key):
+        item = self.data.pop(key, None)
+        if item != None:
+            self.size -= len(item[1])
+
+class WriteBuffer(object):
+    """
+    Contenido de un fichero escrito pero aun no enviado a vaultier
+    """
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.last_write = time.monotonic()
+        # Su contenido no es valido, no se reintenta hasta la siguiente escritura
+        self.failed = False
 
 class TestFs(llfuse.Operations):
     """
-    Asignacion de inodos:
-    1xxxxx -> workspaces
-    2xxxxx -> vaults
-    3xxxxx -> cards
-    4xxxxx -> secrets
+    Asignacion de inodos (tipo en los 8 bits altos, id en los 56 bajos):
+    0x01xxxxxxxxxxxxxx -> workspaces
+    0x02xxxxxxxxxxxxxx -> vaults
+    0x03xxxxxxxxxxxxxx -> cards
+    0x04xxxxxxxxxxxxxx -> secrets
+    0x05xxxxxxxxxxxxxx -> ficheros adjuntos de los secrets (mismo id que su secret)
+    0x06xxxxxxxxxxxxxx -> ficheros creados que aun no se han enviado (id local)
+
+    La tabla de inodos guarda el tipo, id y padre de cada inodo entregado al
+    kernel. Cuando el kernel los olvida (forget) se borran de la tabla, junto
+    con sus locks y los elementos de su listado que el kernel no conoce.
+    Listados y atributos se cachean durante attr_ttl segundos (el
+    kernel los cachea el mismo tiempo) y el contenido de los secrets durante
+    content_ttl segundos en una cache limitada a cache_size bytes.
+
+    Con varios workers, llfuse ejecuta las peticiones en varios hilos pero
+    con su lock global tomado. Las llamadas a vaultier se hacen liberando ese
+    lock, de modo que las esperas de red de varias peticiones se solapan, y
+    por eso las caches tienen sus propios locks.
+
+    Las escrituras se guardan en buffers y se envian (un solo PUT o POST por
+    fichero) en fsync, al cerrar el fichero o cuando pasan writeback_delay
+    segundos sin escribir en el. Los envios de varios ficheros se hacen en
+    paralelo. Los ficheros creados en una card son secrets nuevos; su
+    contenido es el JSON del data del secret, como en los existentes. Estos
+    solo se envian cuando pasan writeback_delay segundos, porque los editores
+    guardan escribiendo un fichero temporal que renombran sobre el original
+    justo despues de cerrarlo: si llega ese rename, el contenido se envia al
+    secret original con un solo PUT y el temporal nunca se crea en vaultier.
+
+    Un hilo revalida cada refresh_interval segundos los directorios usados
+    recientemente. Si algo ha cambiado en el servidor, actualiza las caches y
+    pide al kernel que olvide lo que tenia cacheado, asi las lecturas se
+    sirven siempre de la cache pero los cambios se ven en refresh_interval
+    segundos como mucho.
     """
-    def __init__(self, vault):
+    def __init__(self, vault, attr_ttl=ATTR_TTL, content_ttl=CONTENT_TTL, cache_size=CACHE_SIZE, workers=WORKERS, writeback_delay=WRITEBACK_DELAY):
         super(TestFs, self).__init__()
-        self.hello_name = b"message"
-        self.hello_inode = llfuse.ROOT_INODE+1
-        self.hello_data = b"hello world\n"
         self.vault = vault
+        self.attr_ttl = attr_ttl
+        self.inodes = {llfuse.ROOT_INODE: Node('root', None, None)}
+        self.lookups = {}
+        self.workspace_keys = {}
+        self.download_locks = {}
+        self.listings = TTLCache(attr_ttl)
+        self.attrs = TTLCache(attr_ttl)
+        self.secrets = TTLCache(attr_ttl)
+        self.contents = ContentCache(cache_size, content_ttl)
+        self.writeback_delay = writeback_delay
+        self.buffers = {}
+        self.buffers_lock = threading.Lock()
+        self.write_locks = {}
+        self.new_ids = itertools.count(1)
+        self.new_files = {}
+        self.new_names = {}
+        self.secret_inodes = {}
+        self.executor = ThreadPoolExecutor(max(workers, 1))
+        self.accessed = {}
+
+    def secret_inode(self, secret_id):
+        """
+        Retorna el inodo de un secret
+        Los secrets creados desde un fichero nuevo conservan el inodo de este
+        """
+        return self.secret_inodes.get(secret_id, make_inode('secret', secret_id))
+
+    def node(self, inode):
+        """Retorna la entrada de la tabla de inodos"""
+        node = self.inodes.get(inode)
+        if node == None:
+            raise llfuse.FUSEError(errno.ENOENT)
+        return node
+
+    def call(self, function, *args):
+        """
+        Llama al cliente de vaultier convirtiendo sus errores en EIO (o en
+        ENOENT si el elemento no existe en el servidor)
+        Mientras espera la respuesta otros hilos pueden atender peticiones
+        """
+        with llfuse.lock_released:
+            return self.request(function, *args)
+
+    def request(self, function, *args):
+        """Como call, pero para usar con el lock global ya liberado"""
+        try:
+            return function(*args)
+        except llfuse.FUSEError:
+            raise
+        except ResourceUnavailable as e:
+            log.error("Error llamando a %s%s: %s", function.__name__, args, e)
+            raise llfuse.FUSEError(errno.ENOENT if e._status == 404 else errno.EIO)
+        except (Exception, SystemExit) as e:
+            log.error("Error llamando a %s%s: %s", function.__name__, args, e)
+            raise llfuse.FUSEError(errno.EIO)
+
+    def children(self, inode):
+        """
+        Retorna el listado de un directorio (Listing)
+        Los elementos listados se añaden a la tabla de inodos
+        """
+        self.accessed[inode] = time.monotonic()
+        listing = self.listings.get(inode)
+        if listing != None:
+            return listing
+        return self.load_children(inode)
+
+    def load_children(self, inode):
+        """Pide a vaultier el listado de un directorio y lo guarda en la cache"""
+        node = self.node(inode)
+        if node.kind == 'root':
+            elements = self.call(self.vault.list_workspaces)
+        elif node.kind == 'workspace':
+            elements = self.call(self.vault.list_vaults, node.id)
+        elif node.kind == 'vault':
+            elements = self.call(self.vault.list_cards, node.id)
+        elif node.kind == 'card':
+            elements = self.call(self.vault.list_secrets, node.id)
+        else:
+            raise llfuse.FUSEError(errno.ENOTDIR)
+        kind = CHILD_KIND[node.kind]
+        entries = []
+        for element in elements:
+            child_inode = self.secret_inode(element.id) if kind == 'secret' else make_inode(kind, element.id)
+            self.inodes[child_inode] = Node(kind, element.id, inode)
+            entries.append((bytes(element.name, "UTF-8"), child_inode))
+            if kind == 'workspace':
+                self.workspace_keys[element.id] = element.workspaceKey
+        if kind == 'secret':
+            entries.extend(self.call(self.prefetch_secrets, inode, elements))
+        # Los nombres repetidos se guardan sin inodo, no se sabe cual retornar
+        index = {}
+        for name, child_inode in entries:
+            index[name] = None if name in index else child_inode
+        return self.listings.set(inode, Listing(entries, index))
+
+    def prefetch_secrets(self, card_inode, secrets):
+        """
+        Descifra todos los secrets de una card a partir de su listado, sin
+        pedirlos uno a uno, y guarda sus contenidos y atributos en las caches
+        Asi un 'ls -l' de la card no hace ninguna peticion mas
+        Retorna las entradas (name, inode) de los ficheros adjuntos, que se
+        muestran en la card con su nombre de fichero
+        """
+        workspace_key = self.workspace_key(card_inode)
+        attachments = []
+        for secret in secrets:
+            inode = self.secret_inode(secret.id)
+            secret = self.secrets.set(secret.id, self.vault.decrypt_secret(secret, workspace_key))
+            data = bytes(json.dumps(secret.data), "UTF-8")
+            self.contents.set(inode, data)
+            self.attrs.set(inode, self.new_entry(inode, stat.S_IFREG | 0o644, len(data)))
+            if secret.blobMeta:
+                attachment_inode = make_inode('attachment', secret.id)
+                self.inodes[attachment_inode] = Node('attachment', secret.id, card_inode)
+                self.attrs.set(attachment_inode, self.new_entry(attachment_inode, stat.S_IFREG | 0o644, secret.blobMeta['filesize']))
+                attachments.append((bytes(secret.blobMeta['filename'], "UTF-8"), attachment_inode))
+        return attachments
+
+    def fetch_secret(self, secret_id, card_inode):
+        """Pide un secret a vaultier y lo retorna con sus datos descifrables"""
+        secret = Secret.from_json(self.vault.fetch_json_uncached('/api/secrets/{}'.format(secret_id)))
+        return self.secrets.set(secret_id, self.vault.decrypt_secret(secret, self.workspace_key(card_inode)))
+
+    def fetch_file(self, secret_id, card_inode):
+        """Descarga y descifra el fichero adjunto de un secret"""
+        blob = self.vault.fetch_json_uncached('/api/secret_blobs/{}'.format(secret_id))['blob_data']
+        return bytes(json.loads(self.vault.cypher.decrypt(self.workspace_key(card_inode), blob))['filedata'], "iso-8859-1")
+
+    def workspace_key(self, card_inode):
+        """Retorna la clave del workspace que contiene una card"""
+        workspace_id = self.node(self.node(self.node(card_inode).parent).parent).id
+        if workspace_id not in self.workspace_keys:
+            self.workspace_keys[workspace_id] = self.vault.get_workspace(workspace_id).workspaceKey
+        return self.workspace_keys[workspace_id]
+
+    def content(self, inode):
+        """Retorna el contenido de un secret (el JSON de su data)"""
+        data = self.contents.get(inode)
+        if data == None:
+            node = self.node(inode)
+            secret = self.call(self.fetch_secret, node.id, node.parent)
+            data = self.contents.set(inode, bytes(json.dumps(secret.data), "UTF-8"))
+        return data
+
+    def attachment(self, inode, off, size):
+        """
+        Retorna 'size' bytes de un fichero adjunto empezando en 'off'
+
+        Vaultier solo permite descargar el fichero entero, asi que se descarga
+        y descifra una vez y se guarda en trozos en la cache de contenidos.
+        Las lecturas siguientes se sirven de esos trozos. Las lecturas se
+        recortan al tamaño del fichero, asi que leer tras el final no vuelve
+        a descargarlo.
+        """
+        file_size = self.getattr(inode).st_size
+        if off >= file_size or size <= 0:
+            return b''
+        first, last = off // CHUNK_SIZE, (min(off + size, file_size) - 1) // CHUNK_SIZE
+        chunks = [self.contents.get((inode, index)) for index in range(first, last + 1)]
+        if None not in chunks:
+            data = b''.join(chunks)
+            return data[off - first * CHUNK_SIZE:off - first * CHUNK_SIZE + size]
+        # Solo un hilo descarga cada fichero, el resto espera y usa la cache
+        lock = self.download_locks.setdefault(inode, threading.Lock())
+        with llfuse.lock_released, lock:
+            chunks = [self.contents.get((inode, index)) for index in range(first, last + 1)]
+            if None not in chunks:
+                data = b''.join(chunks)
+                return data[off - first * CHUNK_SIZE:off - first * CHUNK_SIZE + size]
+            node = self.node(inode)
+            file_data = self.request(self.fetch_file, node.id, node.parent)
+            indexes = list(range(0, (len(file_data) + CHUNK_SIZE - 1) // CHUNK_SIZE))
+            # Los trozos pedidos y los siguientes se guardan los ultimos para
+            # que sean los ultimos en salir de la cache si el fichero no cabe
+            for index in indexes[:first] + indexes[first:][::-1]:
+                self.contents.set((inode, index), file_data[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE])
+        return file_data[off:off + size]
 
-    @lru_cache(maxsize=32)
     def getattr(self, inode, ctx=None):
         """
         Obtenemos las propiedades de un inodo
@@ -77,20 +423,34 @@ class TestFs(llfuse.Operations):
             log.info("%s (inode=%s, pid=%s, uid=%s)" % (sys._getframe().f_code.co_name, inode, ctx.pid, ctx.uid))
         else:
             log.info("%s (inode=%s, pid=, uid=)" % (sys._getframe().f_code.co_name, inode))
-        entry = llfuse.EntryAttributes()
-        # Todo lo que no sean secrets son directorios
-        if inode < SECRET_BASE_INODO:
+        # Los ficheros con escrituras pendientes tienen el tamaño de su buffer
+        buffer = self.buffers.get(inode)
+        if buffer != None or self.node(inode).kind == 'new':
+            return self.new_entry(inode, stat.S_IFREG | 0o644, len(buffer.data) if buffer else 0)
+        entry = self.attrs.get(inode)
+        if entry != None:
+            return entry
+        node = self.node(inode)
+        # Todo lo que no sean secrets o adjuntos son directorios
+        if node.kind == 'attachment':
+            log.debug("Calificamos este inodo como fichero adjunto")
+            secret = self.call(self.fetch_secret, node.id, node.parent)
+            entry = self.new_entry(inode, stat.S_IFREG | 0o644, secret.blobMeta['filesize'] if secret.blobMeta else 0)
+        elif node.kind != 'secret':
             log.debug("Calificamos este inodo como directorio")
-            entry.st_mode = (stat.S_IFDIR | 0o755)
-            entry.st_size = 0
+            entry = self.new_entry(inode, stat.S_IFDIR | 0o755, 0)
         else:
             log.debug("Calificamos este inodo como fichero")
-            entry.st_mode = (stat.S_IFREG | 0o644)
-            secret_id = inode - SECRET_BASE_INODO
-            log.debug("Obteniendo len(get_secret(%s).data)", secret_id)
-            data = bytes(json.dumps(self.get_secret(secret_id).data), "UTF-8")
-            entry.st_size = len(data)
+            log.debug("Obteniendo len(get_secret(%s).data)", node.id)
+            entry = self.new_entry(inode, stat.S_IFREG | 0o644, len(self.content(inode)))
+
+        return self.attrs.set(inode, entry)
 
+    def new_entry(self, inode, mode, size):
+        """Crea los atributos de un inodo"""
+        entry = llfuse.EntryAttributes()
+        entry.st_mode = mode
+        entry.st_size = size
         stamp = int(1438467123.985654 * 1e9)
         entry.st_atime_ns = stamp
         entry.st_ctime_ns = stamp
@@ -98,55 +458,71 @@ class TestFs(llfuse.Operations):
         entry.st_gid = os.getgid()
         entry.st_uid = os.getuid()
         entry.st_ino = inode
-
+        # El kernel puede cachear nombre y atributos el mismo tiempo que nosotros
+        entry.entry_timeout = self.attr_ttl
+        entry.attr_timeout = self.attr_ttl
         return entry
 
-    def _get_id_from_name(self, elements, name):
-        """
-        A partir de una lista de elementos, obtenemos el id segun el nombre
-        Si hay dos elementos con el mismo nombre retornamos el primero
-        """
-        # TODO: fallar si se encuentran dos elementos en el filtrado
-        filter_list = list(filter(lambda w: w.name == str(name, "UTF-8"), elements))
-        if len(filter_list) != 1:
-            raise llfuse.FUSEError(errno.ENOENT)
-        return filter_list.pop().id
-
     def lookup(self, parent_inode, name, ctx=None):
         """
         Obtener los atributos de un elemento por su nombre
+        Si hay varios elementos con el mismo nombre no se retorna ninguno
         """
         log.info("%s (parent_inode=%s, name=%s, pid=%s, uid=%s)" % (sys._getframe().f_code.co_name, parent_inode, name, ctx.pid, ctx.uid))
-        inode = None
-
-        if parent_inode == 1:
-            log.info("ROOT path del punto de montaje. Retornar workspaces")
-            wks = self.list_workspaces()
-            inode = self._get_id_from_name(wks, name) + WORKSPACE_BASE_INODO
-        elif parent_inode >= WORKSPACE_BASE_INODO and parent_inode < VAULT_BASE_INODO:
-            log.info("Es un workspace. Retornar vaults")
-            wks_id = parent_inode - WORKSPACE_BASE_INODO
-            vaults = self.list_vaults(wks_id)
-            inode = self._get_id_from_name(vaults, name) + VAULT_BASE_INODO
-        elif parent_inode >= VAULT_BASE_INODO and parent_inode < CARD_BASE_INODO:
-            log.info("Es un vault. Retornar cards")
-            vault_id = parent_inode - VAULT_BASE_INODO
-            cards = self.list_cards(vault_id)
-            inode = self._get_id_from_name(cards, name) + CARD_BASE_INODO
-        elif parent_inode >= CARD_BASE_INODO and parent_inode < SECRET_BASE_INODO:
-            log.info("Es una card. Retornar secrets")
-            card_id = parent_inode - CARD_BASE_INODO
-            secrets = self.list_secrets(card_id)
-            inode = self._get_id_from_name(secrets, name) + SECRET_BASE_INODO
-        else:
-            log.info("Es un secret. Retornar el contenido")
-
-        if not inode:
+        # TODO: permitir elementos con el mismo nombre
+        inode = self.find(parent_inode, name)
+        if inode == None:
             raise llfuse.FUSEError(errno.ENOENT)
 
-        return self.getattr(inode, ctx)
+        entry = self.getattr(inode, ctx)
+        self.lookups[inode] = self.lookups.get(inode, 0) + 1
+        return entry
+
+    def forget(self, inode_list):
+        """
+        El kernel ya no usa estos inodos (tras tantos lookups como indica)
+        """
+        for inode, nlookup in inode_list:
+            count = self.lookups.get(inode, 0) - nlookup
+            if count > 0:
+                self.lookups[inode] = count
+            else:
+                self.lookups.pop(inode, None)
+                self.drop_inode(inode)
+
+    def drop_inode(self, inode):
+        """
+        Borra un inodo de la tabla de inodos y sus locks
+        Los ficheros con escrituras pendientes se conservan
+        """
+        node = self.inodes.get(inode)
+        if node == None or node.kind == 'root' or inode in self.buffers or inode in self.new_names:
+            return
+        # El listado del padre volvera a añadir el inodo si se vuelve a usar
+        self.listings.invalidate(node.parent)
+        listing = self.listings.peek(inode)
+        self.listings.invalidate(inode)
+        self.inodes.pop(inode, None)
+        self.accessed.pop(inode, None)
+        if node.kind == 'secret' and self.secret_inodes.get(node.id) == inode:
+            self.secret_inodes.pop(node.id, None)
+        for locks in (self.download_locks, self.write_locks):
+            lock = locks.get(inode)
+            if lock != None and not lock.locked():
+                locks.pop(inode, None)
+        # Los elementos listados que el kernel no conoce no se pueden usar ya
+        if listing != None:
+            for _, child_inode in listing.entries:
+                if child_inode not in self.lookups:
+                    self.drop_inode(child_inode)
+
+    def find(self, parent_inode, name):
+        """Retorna el inodo de un elemento de un directorio o None"""
+        inode = self.new_files.get((parent_inode, name))
+        if inode == None:
+            inode = self.children(parent_inode).index.get(name)
+        return inode
 
-    @lru_cache(maxsize=32)
     def opendir(self, inode, ctx):
         """
         Aqui transformamos el inodo en un filehandle que se pasara a reddir, fsyncdir y releasedir
@@ -154,6 +530,8 @@ class TestFs(llfuse.Operations):
         Para simplificar, pasamos el mismo id del inodo
         """
         log.info("%s (inode=%s, pid=%s, uid=%s)" % (sys._getframe().f_code.co_name, inode, ctx.pid, ctx.uid))
+        if self.node(inode).kind in FILE_KINDS:
+            raise llfuse.FUSEError(errno.ENOTDIR)
         return inode
 
     def readdir(self, fh, off):
@@ -163,71 +541,14 @@ class TestFs(llfuse.Operations):
         """
         log.info("%s (fh=%s, off=%s)" % (sys._getframe().f_code.co_name, fh, off))
 
-        if fh == 1:
-            log.info("ROOT path del punto de montaje. Retornar workspaces")
-            for i,v in enumerate(self.list_workspaces()):
-                # Skip elementos segun off
-                if off > i:
-                    continue
-                log.debug("Yield (%s, attr, %s)", v.name, i)
-                yield(bytes(v.name, "UTF-8"), self.getattr(v.id+WORKSPACE_BASE_INODO), i+1)
-        elif fh >= WORKSPACE_BASE_INODO and fh < VAULT_BASE_INODO:
-            log.info("Es un workspace. Retornar vaults")
-            idx = fh - WORKSPACE_BASE_INODO
-            log.debug("Obteniendo vaults para el workspace %s", idx)
-            for i,v in enumerate(self.list_vaults(idx)):
-                # Skip elementos segun off
-                if off > i:
-                    continue
-                log.debug("Yield (%s, attr, %s)", v.name, i)
-                yield(bytes(v.name, "UTF-8"), self.getattr(v.id+VAULT_BASE_INODO), i+1)
-        elif fh >= VAULT_BASE_INODO and fh < CARD_BASE_INODO:
-            log.info("Es un vault. Retornar cards")
-            idx = fh - VAULT_BASE_INODO
-            log.debug("Obteniendo cards para el vault %s", idx)
-            for i,v in enumerate(self.list_cards(idx)):
-                # Skip elementos segun off
-                if off > i:
-                    continue
-                log.debug("Yield (%s, attr, %s)", v.name, i)
-                yield(bytes(v.name, "UTF-8"), self.getattr(v.id+CARD_BASE_INODO), i+1)
-        elif fh >= CARD_BASE_INODO and fh < SECRET_BASE_INODO:
-            log.info("Es una card. Retornar secrets")
-            idx = fh - CARD_BASE_INODO
-            log.debug("Obteniendo secrets para la card %s", idx)
-            for i,v in enumerate(self.list_secrets(idx)):
-                # Skip elementos segun off
-                if off > i:
-                    continue
-                log.debug("Yield (%s, attr, %s)", v.name, i)
-                yield(bytes(v.name, "UTF-8"), self.getattr(v.id+SECRET_BASE_INODO), i+1)
-        else:
-            log.info("Es un secret. Retornar el contenido")
-
-    # Cache vaultier responses
-    @lru_cache(maxsize=32)
-    def list_workspaces(self):
-        return self.vault.list_workspaces()
-
-    @lru_cache(maxsize=32)
-    def list_vaults(self, idx):
-        return self.vault.list_vaults(idx)
-
-    @lru_cache(maxsize=32)
-    def list_cards(self, idx):
-        return self.vault.list_cards(idx)
-
-    @lru_cache(maxsize=32)
-    def list_secrets(self, idx):
-        return self.vault.list_secrets(idx)
-
-    @lru_cache(maxsize=32)
-    def get_secret(self, idx):
-        return self.vault.get_secret(idx)
-
+        entries = self.children(fh).entries + [(name, inode) for (parent, name), inode in list(self.new_files.items()) if parent == fh]
+        for i, (name, inode) in enumerate(entries):
+            # Skip elementos segun off
+            if off > i:
+                continue
+            log.debug("Yield (%s, attr, %s)", name, i)
+            yield(name, self.getattr(inode), i+1)
 
-
-    @lru_cache(maxsize=32)
     def open(self, inode, flags, ctx):
         """
         Retorna un filehandler con el fichero abierto.
@@ -239,18 +560,348 @@ class TestFs(llfuse.Operations):
         #    raise llfuse.FUSEError(errno.ENOENT)
         #if flags & os.O_RDWR or flags & os.O_WRONLY:
         #    raise llfuse.FUSEError(errno.EPERM)
+        kind = self.node(inode).kind
+        if kind not in FILE_KINDS:
+            raise llfuse.FUSEError(errno.EISDIR)
+        if kind == 'attachment' and flags & (os.O_RDWR | os.O_WRONLY):
+            raise llfuse.FUSEError(errno.EACCES)
         return inode
 
-    @lru_cache(maxsize=32)
     def read(self, fh, off, size):
         """
         Leemos 'size' bytes del fichero 'fh' empezando en 'off'
         Si paasmos mas bytes que los especificados en 'size', la salida sera truncada igualmente
         """
         log.info("%s (fh=%s, off=%s, size=%s)" % (sys._getframe().f_code.co_name, fh, off, size))
-        secret_id = fh - SECRET_BASE_INODO
-        data = bytes(json.dumps(self.get_secret(secret_id).data), "UTF-8")
-        return data[off:off+size]
+        self.accessed[self.node(fh).parent] = time.monotonic()
+        if self.node(fh).kind == 'attachment':
+            return self.attachment(fh, off, size)
+        buffer = self.buffers.get(fh)
+        if buffer != None:
+            return bytes(buffer.data[off:off+size])
+        return self.content(fh)[off:off+size]
+
+    def buffer(self, inode):
+        """Retorna el buffer de escritura de un fichero, creandolo si no existe"""
+        buffer = self.buffers.get(inode)
+        if buffer == None:
+            if self.node(inode).kind not in ('secret', 'new'):
+                raise llfuse.FUSEError(errno.EACCES)
+            data = self.content(inode) if self.node(inode).kind == 'secret' else b''
+            with self.buffers_lock:
+                buffer = self.buffers.setdefault(inode, WriteBuffer(data))
+        return buffer
+
+    def write(self, fh, off, buf):
+        """
+        Escribimos en el buffer del fichero, se enviara a vaultier mas tarde
+        """
+        log.info("%s (fh=%s, off=%s, size=%s)" % (sys._getframe().f_code.co_name, fh, off, len(buf)))
+        buffer = self.buffer(fh)
+        with self.buffers_lock:
+            if off > len(buffer.data):
+                buffer.data.extend(bytes(off - len(buffer.data)))
+            buffer.data[off:off+len(buf)] = buf
+            buffer.last_write = time.monotonic()
+            buffer.failed = False
+        return len(buf)
+
+    def setattr(self, inode, attr, fields, fh, ctx):
+        """
+        Solo se permite cambiar el tamaño (truncate), el resto de atributos son fijos
+        """
+        log.info("%s (inode=%s, pid=%s, uid=%s)" % (sys._getframe().f_code.co_name, inode, ctx.pid, ctx.uid))
+        if fields.update_size:
+            buffer = self.buffer(inode)
+            with self.buffers_lock:
+                if attr.st_size < len(buffer.data):
+                    del buffer.data[attr.st_size:]
+                else:
+                    buffer.data.extend(bytes(attr.st_size - len(buffer.data)))
+                buffer.last_write = time.monotonic()
+                buffer.failed = False
+        return self.getattr(inode, ctx)
+
+    def create(self, parent_inode, name, mode, flags, ctx):
+        """
+        Creamos un fichero en una card. No se crea el secret en vaultier
+        hasta que se envia su contenido
+        """
+        log.info("%s (parent_inode=%s, name=%s, pid=%s, uid=%s)" % (sys._getframe().f_code.co_name, parent_inode, name, ctx.pid, ctx.uid))
+        if self.node(parent_inode).kind != 'card':
+            raise llfuse.FUSEError(errno.EPERM)
+        if self.find(parent_inode, name) != None:
+            raise llfuse.FUSEError(errno.EEXIST)
+        new_id = next(self.new_ids)
+        inode = make_inode('new', new_id)
+        self.inodes[inode] = Node('new', new_id, parent_inode)
+        self.new_names[inode] = name
+        with self.buffers_lock:
+            self.buffers[inode] = WriteBuffer(b'')
+        self.new_files[(parent_inode, name)] = inode
+        entry = self.getattr(inode, ctx)
+        self.lookups[inode] = self.lookups.get(inode, 0) + 1
+        return (inode, entry)
+
+    def fsync(self, fh, datasync):
+        log.info("%s (fh=%s)" % (sys._getframe().f_code.co_name, fh))
+        # Los ficheros nuevos esperan a writeback_delay por si se renombran
+        if self.node(fh).kind == 'new':
+            return
+        with llfuse.lock_released:
+            self.write_back(fh)
+
+    def release(self, fh):
+        log.info("%s (fh=%s)" % (sys._getframe().f_code.co_name, fh))
+        if self.node(fh).kind == 'new':
+            return
+        with llfuse.lock_released:
+            self.write_back(fh)
+
+    def unlink(self, parent_inode, name, ctx):
+        """
+        Borramos un secret (los ficheros adjuntos no se pueden borrar solos)
+        """
+        log.info("%s (parent_inode=%s, name=%s, pid=%s, uid=%s)" % (sys._getframe().f_code.co_name, parent_inode, name, ctx.pid, ctx.uid))
+        inode = self.find(parent_inode, name)
+        if inode == None:
+            raise llfuse.FUSEError(errno.ENOENT)
+        node = self.node(inode)
+        if node.kind not in ('secret', 'new'):
+            raise llfuse.FUSEError(errno.EPERM)
+        with self.buffers_lock:
+            self.buffers.pop(inode, None)
+        if node.kind == 'new':
+            self.new_files.pop((parent_inode, name), None)
+            self.new_names.pop(inode, None)
+        else:
+            self.call(self.vault.delete_secret, node.id)
+            self.forget_secret(inode)
+
+    def rename(self, parent_inode_old, name_old, parent_inode_new, name_new, ctx):
+        """
+        Renombramos un secret o lo movemos a otra card
+
+        Si se renombra un fichero nuevo sobre un secret existente (lo que
+        hacen muchos editores al guardar) el secret se queda con el contenido
+        del fichero nuevo, conservando su id y su fichero adjunto. Como el
+        fichero nuevo aun no se ha enviado, basta con un PUT del secret.
+        """
+        log.info("%s (parent_inode_old=%s, name_old=%s, parent_inode_new=%s, name_new=%s)" % (sys._getframe().f_code.co_name, parent_inode_old, name_old, parent_inode_new, name_new))
+        source = self.find(parent_inode_old, name_old)
+        if source == None:
+            raise llfuse.FUSEError(errno.ENOENT)
+        node = self.node(source)
+        if node.kind not in ('secret', 'new') or self.node(parent_inode_new).kind != 'card':
+            raise llfuse.FUSEError(errno.EPERM)
+        target = self.find(parent_inode_new, name_new)
+        if target == source:
+            return
+        if target != None and self.node(target).kind == 'secret' and node.kind == 'new':
+            # El inodo nuevo pasa a ser el del secret existente
+            target_node = self.node(target)
+            self.new_files.pop((parent_inode_old, name_old), None)
+            self.new_names.pop(source, None)
+            self.inodes[source] = Node('secret', target_node.id, target_node.parent)
+            self.secret_inodes[target_node.id] = source
+            with llfuse.lock_released:
+                self.write_back(source)
+            self.forget_secret(target)
+            return
+        if target != None:
+            self.unlink(parent_inode_new, name_new, ctx)
+        if node.kind == 'new':
+            self.new_files.pop((parent_inode_old, name_old), None)
+            self.new_files[(parent_inode_new, name_new)] = source
+            self.new_names[source] = name_new
+            self.inodes[source] = Node('new', node.id, parent_inode_new)
+            return
+        with llfuse.lock_released:
+            self.request(self.move_secret, source, parent_inode_new, name_new)
+        self.listings.invalidate(parent_inode_old)
+        self.forget_secret(source)
+
+    def move_secret(self, inode, card_inode, name):
+        """Cambia nombre y card de un secret, enviando tambien sus escrituras pendientes"""
+        node = self.node(inode)
+        workspace_key = self.workspace_key(card_inode)
+        secret = self.fetch_secret(node.id, node.parent)
+        if workspace_key != self.workspace_key(node.parent) and secret.blobMeta:
+            # El fichero adjunto esta cifrado con la clave del otro workspace
+            raise llfuse.FUSEError(errno.EXDEV)
+        with self.buffers_lock:
+            buffer = self.buffers.pop(inode, None)
+        if buffer != None:
+            secret.data = self.parse(buffer.data)
+        # El data se descifra con la clave de origen y se cifra con la de destino
+        secret.name = str(name, "UTF-8")
+        secret.card = self.node(card_inode).id
+        self.vault.set_secret(secret, None, workspace_key)
+        self.inodes[inode] = Node('secret', node.id, card_inode)
+
+    def forget_secret(self, inode):
+        """Olvida lo cacheado de un secret y del listado de su card"""
+        node = self.node(inode)
+        self.contents.invalidate(inode)
+        self.attrs.invalidate(inode)
+        self.secrets.invalidate(node.id)
+        self.listings.invalidate(node.parent)
+
+    def parse(self, data):
+        """Retorna el data de un secret a partir del contenido de su fichero"""
+        if not bytes(data).strip():
+            return {}
+        try:
+            return json.loads(bytes(data).decode("UTF-8"))
+        except ValueError as e:
+            log.error("El contenido no es JSON valido: %s", e)
+            raise llfuse.FUSEError(errno.EINVAL)
+
+    def write_back(self, inode):
+        """
+        Envia a vaultier las escrituras pendientes de un fichero
+        Se llama con el lock global de llfuse liberado
+        """
+        lock = self.write_locks.setdefault(inode, threading.Lock())
+        with lock:
+            with self.buffers_lock:
+                buffer = self.buffers.pop(inode, None)
+                if buffer == None:
+                    return
+                data = bytes(buffer.data)
+                # Mientras se envia, las lecturas se sirven del nuevo contenido
+                self.contents.set(inode, data)
+            try:
+                self.upload(inode, data)
+            except BaseException as e:
+                # Si el contenido no es valido reintentarlo no sirve de nada
+                buffer.failed = isinstance(e, llfuse.FUSEError) and e.errno == errno.EINVAL
+                with self.buffers_lock:
+                    self.buffers.setdefault(inode, buffer)
+                self.contents.invalidate(inode)
+                raise
+            self.attrs.invalidate(inode)
+
+    def upload(self, inode, data):
+        """Crea o actualiza en vaultier el secret de un fichero"""
+        node = self.node(inode)
+        secret_data = self.parse(data)
+        workspace_key = self.request(self.workspace_key, node.parent)
+        if node.kind == 'new':
+            name = self.new_names[inode]
+            type = 'password' if isinstance(secret_data, dict) and 'password' in secret_data else 'note'
+            new_secret = self.request(self.vault.add_secret, self.node(node.parent).id, str(name, "UTF-8"), secret_data, type, None, workspace_key)
+            self.inodes[inode] = Node('secret', new_secret['id'], node.parent)
+            self.secrets.set(new_secret['id'], Secret(new_secret['id'], type, str(name, "UTF-8"), secret_data, None, self.node(node.parent).id))
+            self.secret_inodes[new_secret['id']] = inode
+            self.new_files.pop((node.parent, name), None)
+            self.new_names.pop(inode, None)
+        else:
+            # Nombre, tipo y card se toman del ultimo listado si no ha caducado
+            secret = self.secrets.get(node.id)
+            if secret == None:
+                secret = self.request(self.fetch_secret, node.id, node.parent)
+            secret = Secret(secret.id, secret.type, secret.name, secret._data, secret._blobMeta, secret.card, secret.workspaceKey, secret.cypher)
+            secret.data = secret_data
+            self.request(self.vault.set_secret, secret, None, workspace_key)
+            self.secrets.set(node.id, secret)
+        self.listings.invalidate(node.parent)
+
+    def write_back_pending(self):
+        """
+        Hilo que envia en paralelo los ficheros que llevan writeback_delay
+        segundos sin escrituras (salvo los que fallaron por contenido invalido)
+        """
+        while True:
+            time.sleep(max(self.writeback_delay / 2, 0.1))
+            now = time.monotonic()
+            with self.buffers_lock:
+                inodes = [inode for inode, buffer in self.buffers.items() if not buffer.failed and now - buffer.last_write >= self.writeback_delay]
+            for inode in inodes:
+                self.executor.submit(self.write_back_logged, inode)
+
+    def write_back_logged(self, inode):
+        try:
+            self.write_back(inode)
+        except llfuse.FUSEError as e:
+            log.error("No se pudo enviar el inodo %s: error %s", inode, e.errno)
+
+    def write_back_all(self):
+        """Envia todas las escrituras pendientes (al desmontar)"""
+        for inode in list(self.buffers):
+            self.write_back_logged(inode)
+
+    def refresh_accessed(self, interval):
+        """
+        Hilo que revalida periodicamente los directorios usados recientemente
+
+        Un directorio deja de revalidarse cuando caduca o ya no existe. Si
+        falla por otro motivo (error del servidor, timeout) se reintenta en
+        el siguiente intervalo.
+        """
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            for inode, last_access in list(self.accessed.items()):
+                if now - last_access > REFRESH_WINDOW:
+                    self.accessed.pop(inode, None)
+                    continue
+                try:
+                    with llfuse.lock:
+                        invalid_entries, invalid_inodes = self.refresh(inode)
+                except llfuse.FUSEError as e:
+                    if e.errno == errno.ENOENT:
+                        # Ya no existe, se vera al revalidar su padre
+                        self.accessed.pop(inode, None)
+                    else:
+                        log.warning("No se pudo revalidar el inodo %s: error %s", inode, e.errno)
+                    continue
+                except Exception as e:
+                    log.warning("No se pudo revalidar el inodo %s: %s", inode, e)
+                    continue
+                for name in invalid_entries:
+                    log.debug("Invalidando entrada %s de %s", name, inode)
+                    llfuse.invalidate_entry(inode, name)
+                for child_inode in invalid_inodes:
+                    log.debug("Invalidando inodo %s", child_inode)
+                    llfuse.invalidate_inode(child_inode)
+
+    def refresh(self, inode):
+        """
+        Vuelve a pedir el listado de un directorio y lo compara con el cacheado
+        Se llama con el lock global de llfuse tomado
+
+        :return: nombres que han cambiado de inodo o desaparecido, e inodos
+            cuyo contenido o tamaño ha cambiado
+        """
+        old_listing = self.listings.peek(inode)
+        old_attrs = {}
+        old_contents = {}
+        if old_listing != None:
+            for _, child_inode in old_listing.entries:
+                old_attrs[child_inode] = self.attrs.peek(child_inode)
+                old_contents[child_inode] = self.contents.get(child_inode)
+        new_listing = self.load_children(inode)
+        if old_listing == None:
+            return [], []
+        invalid_entries = [name for name, child_inode in old_listing.index.items() if new_listing.index.get(name) != child_inode]
+        invalid_inodes = []
+        if set(old_listing.index) != set(new_listing.index):
+            invalid_inodes.append(inode)
+        for _, child_inode in new_listing.entries:
+            if child_inode not in old_attrs:
+                continue
+            old_attr, new_attr = old_attrs[child_inode], self.attrs.peek(child_inode)
+            old_content = old_contents[child_inode]
+            if old_content != None and old_content != self.contents.get(child_inode):
+                invalid_inodes.append(child_inode)
+            elif old_attr != None and new_attr != None and old_attr.st_size != new_attr.st_size:
+                invalid_inodes.append(child_inode)
+                if self.node(child_inode).kind == 'attachment':
+                    # Los trozos cacheados son del fichero anterior
+                    for index in range((old_attr.st_size + CHUNK_SIZE - 1) // CHUNK_SIZE):
+                        self.contents.invalidate((child_inode, index))
+        return invalid_entries, invalid_inodes
 
 def init_logging(debug=False):
     #formatter = logging.Formatter('%(asctime)s.%(msecs)03d %(threadName)s: '
@@ -278,6 +929,18 @@ def parse_args():
                         help='Enable debugging output')
     parser.add_argument('--debug-fuse', action='store_true', default=False,
                         help='Enable FUSE debugging output')
+    parser.add_argument('--attr-ttl', type=float, default=ATTR_TTL,
+                        help='Seconds that listings and attributes are cached (default %(default)s)')
+    parser.add_argument('--content-ttl', type=float, default=CONTENT_TTL,
+                        help='Seconds that secret contents are cached (default %(default)s)')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE // (1024 * 1024),
+                        help='Maximum size in MiB of the secret contents cache (default %(default)s)')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='Number of threads serving requests, 1 to serve them one by one (default %(default)s)')
+    parser.add_argument('--writeback-delay', type=float, default=WRITEBACK_DELAY,
+                        help='Seconds without writes after which a file is sent to Vaultier (default %(default)s)')
+    parser.add_argument('--refresh-interval', type=float, default=REFRESH_INTERVAL,
+                        help='Seconds between checks of recently used directories for server changes, 0 to disable (default %(default)s)')
     return parser.parse_args()
 
 
@@ -291,8 +954,18 @@ def main():
         insecure = True
     fake_config = FakeConf()
     vault = vault_main.configure_client(fake_config)
-
-    testfs = TestFs(vault)
+    # Una conexion con el servidor por cada worker
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(options.workers, 1))
+    vault.session.mount('http://', adapter)
+    vault.session.mount('https://', adapter)
+    # La cache de peticiones GET del cliente no caduca nunca, asi que no se
+    # verian los cambios en el servidor ni los hechos desde el propio montaje
+    vault.fetch_json_cached = vault.fetch_json_uncached
+
+    testfs = TestFs(vault, options.attr_ttl, options.content_ttl, options.cache_size * 1024 * 1024, options.workers, options.writeback_delay)
+    threading.Thread(target=testfs.write_back_pending, daemon=True).start()
+    if options.refresh_interval > 0:
+        threading.Thread(target=testfs.refresh_accessed, args=(options.refresh_interval,), daemon=True).start()
     fuse_options = set(llfuse.default_options)
     fuse_options.add('fsname=lltest')
     if options.debug_fuse:
@@ -300,10 +973,12 @@ def main():
     llfuse.init(testfs, options.mountpoint, fuse_options)
     try:
         log.info("Arrancando...")
-        llfuse.main(workers=1)
+        llfuse.main(workers=options.workers)
     except:
         llfuse.close(unmount=False)
         raise
+    finally:
+        testfs.write_back_all()
 
     llfuse.close()
 
@@ -36,9 +36,11 @@ setup(
         "pycryptodomex>=3.4.3",
         "requests>=2.13.0",
         "colorama>=0.3.7",
-        "tabulate>=0.7.7",
-        "treelib>=1.3.5"
+        "tabulate>=0.7.7"
     ],
+    extras_require = {
+        "keepass": ["pykeepass>=3.0"]
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Topic :: Utilities",
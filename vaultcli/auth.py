@@ -9,6 +9,7 @@
 
 from vaultcli.workspacecypher import WorkspaceCypher
 from vaultcli.exceptions import ResourceUnavailable, Unauthorized, Forbidden
+from vaultcli.trace import tracer
 
 from Cryptodome.Hash import SHA
 from urllib.parse import urljoin
@@ -32,12 +33,16 @@ class Auth(object):
         :return: user token string
         :rtype: string
         """
-        work_space_cypher = WorkspaceCypher(self.key)
-        server_time = self.fetch_json('/api/server-time').get('datetime')
-        sha = SHA.new('{}{}'.format(self.email, server_time).encode('utf-8'))
-        signature = binascii.b2a_base64(work_space_cypher.sign(sha))
+        with tracer.span('load key', 'auth'):
+            work_space_cypher = WorkspaceCypher(self.key)
+        with tracer.span('get server time', 'auth'):
+            server_time = self.fetch_json('/api/server-time').get('datetime')
+        with tracer.span('sign', 'auth'):
+            sha = SHA.new('{}{}'.format(self.email, server_time).encode('utf-8'))
+            signature = binascii.b2a_base64(work_space_cypher.sign(sha))
         data = {'email': self.email, 'date': server_time, 'signature': signature}
-        return self.fetch_json('/api/auth/auth', http_method='POST', data=data)['token']
+        with tracer.span('get token', 'auth'):
+            return self.fetch_json('/api/auth/auth', http_method='POST', data=data)['token']
 
     def fetch_json(self, uri_path, http_method='GET', headers={}, params={}, data=None, files=None):
         """Fetch JSON from API"""
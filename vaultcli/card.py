@@ -11,6 +11,8 @@ class Card(object):
     """
     Class representing a Card
     """
+    __slots__ = ('id', 'slug', 'name', 'description', 'vault')
+
     def __init__(self, id, slug, name, description, vault):
         self.id = id
         self.slug = slug
@@ -18,6 +20,12 @@ class Card(object):
         self.description = description
         self.vault = vault
 
+    def __eq__(self, other):
+        return isinstance(other, Card) and self.id == other.id
+
+    def __hash__(self):
+        return hash((Card, self.id))
+
     def from_json(json_obj):
         card = Card(json_obj['id'], json_obj['slug'], json_obj['name'], json_obj['description'], json_obj['vault'])
         return card
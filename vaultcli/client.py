@@ -12,15 +12,21 @@ from vaultcli.vault import Vault
 from vaultcli.card import Card
 from vaultcli.secret import Secret
 from vaultcli.cypher import Cypher
-from vaultcli.exceptions import ResourceUnavailable, Unauthorized, Forbidden
+from vaultcli.exceptions import ResourceUnavailable, Unauthorized, Forbidden, Conflict
+from vaultcli.trace import tracer
 
 from urllib.parse import urljoin
 from os.path import basename
 from mimetypes import MimeTypes
 from functools import lru_cache
+from collections import OrderedDict
 
 import json
 import requests
+import threading
+
+# Number of objects whose last known state is kept to avoid reads before writes
+STATE_CACHE_SIZE = 10000
 
 class Client(object):
     """Base class for Vaultier API access"""
@@ -29,6 +35,10 @@ class Client(object):
         self.token = token
         self.key = key
         self.verify = verify
+        self.cypher = Cypher(key)
+        self.session = requests.Session()
+        self.state = OrderedDict()
+        self.state_lock = threading.Lock()
 
     def list_workspaces(self):
         """
@@ -45,6 +55,7 @@ class Client(object):
             - workspaceKey: workspace key
         """
         json_obj = self.fetch_json('/api/workspaces')
+        for obj in json_obj: self.remember('workspaces', obj)
         return [Workspace.from_json(obj) for obj in json_obj]
 
     def list_vaults(self, workspace_id):
@@ -64,6 +75,7 @@ class Client(object):
             - workspace: workspace that contains this vault
         """
         json_obj = self.fetch_json('/api/vaults/?workspace={}'.format(workspace_id))
+        for obj in json_obj: self.remember('vaults', obj)
         return [Vault.from_json(obj) for obj in json_obj]
 
     def list_cards(self, vault_id):
@@ -82,6 +94,7 @@ class Client(object):
             - vault: vault that contains this card
         """
         json_obj = self.fetch_json('/api/cards/?vault={}'.format(vault_id))
+        for obj in json_obj: self.remember('cards', obj)
         return [Card.from_json(obj) for obj in json_obj]
 
     def list_secrets(self, card_id):
@@ -119,6 +132,7 @@ class Client(object):
             - workspaceKey: workspace key
         """
         json_obj = self.fetch_json('/api/workspaces/{}/'.format(workspace_id))
+        self.remember('workspaces', json_obj)
         return Workspace.from_json(json_obj)
 
     def get_secret(self, secret_id):
@@ -129,19 +143,10 @@ class Client(object):
         :return: a secret object
         :rtype: Secret
         """
-        secret = Secret.from_json(self.fetch_json('/api/secrets/{}'.format(secret_id)))
-        vault_id = self.fetch_json('/api/cards/{}'.format(secret.card))['vault']
-        workspace_id = self.fetch_json('/api/vaults/{}'.format(vault_id))['workspace']
-        workspace_key = self.fetch_json('/api/workspaces/{}'.format(workspace_id))['membership']['workspace_key']
-
-        # If has data decrypt it with workspace_key
-        if secret.data:
-            secret.data = json.loads(Cypher(self.key).decrypt(workspace_key, secret.data))
-        # If has meta decrypt it with workspace_key
-        if secret.blobMeta:
-            secret.blobMeta = json.loads(Cypher(self.key).decrypt(workspace_key, secret.blobMeta))
-
-        return secret
+        json_obj = self.fetch_json('/api/secrets/{}'.format(secret_id))
+        workspace_key = self.get_card_workspace_key(json_obj['card'])
+        # Data and meta are decrypted with workspace_key when they are read
+        return Secret.from_json(json_obj, workspace_key, self.cypher)
 
     def get_file(self, secret_id):
         """
@@ -153,84 +158,166 @@ class Client(object):
         """
         secret = Secret.from_json(self.fetch_json('/api/secrets/{}'.format(secret_id)))
         if secret.blobMeta:
-            vault_id = self.fetch_json('/api/cards/{}'.format(secret.card))['vault']
-            workspace_id = self.fetch_json('/api/vaults/{}'.format(vault_id))['workspace']
-            workspace_key = self.fetch_json('/api/workspaces/{}'.format(workspace_id))['membership']['workspace_key']
-            data = self.fetch_json('/api/secret_blobs/{}'.format(secret_id))['blob_data']
-            file_name = json.loads(Cypher(self.key).decrypt(workspace_key, secret.blobMeta))['filename']
-            file_data = bytes(json.loads(Cypher(self.key).decrypt(workspace_key, data))['filedata'], "iso-8859-1")
+            workspace_key = self.get_card_workspace_key(secret.card)
+            # Blobs can be big, they are never kept in the cache of requests
+            data = self.fetch_json_uncached('/api/secret_blobs/{}'.format(secret_id))['blob_data']
+            file_name = json.loads(self.cypher.decrypt(workspace_key, secret.blobMeta))['filename']
+            file_data = bytes(json.loads(self.cypher.decrypt(workspace_key, data))['filedata'], "iso-8859-1")
             return [file_name, file_data]
         else:
             return [None, None]
 
+    def get_card_workspace_key(self, card_id):
+        """
+        Returns the key of the workspace that contains a card
+
+        :param card_id: Card unique ID given by list_cards
+        :return: workspace key
+        :rtype: string
+        """
+        vault_id = self.fetch_json('/api/cards/{}'.format(card_id))['vault']
+        workspace_id = self.fetch_json('/api/vaults/{}'.format(vault_id))['workspace']
+        return self.fetch_json('/api/workspaces/{}'.format(workspace_id))['membership']['workspace_key']
+
     def decrypt_secret(self, secret, workspace_key):
         """
         Returns given Secret desencrypted
 
+        Data and meta are decrypted when they are read for first time, so
+        secrets whose contents are never used do not cost any decryption.
+
         :param secret: secret object with data encrypted
         :param workspace_key: key string to decrypt data
         :return: a secret object
         :rtype: Secret
         """
-        # If has data decrypt it with workspace_key
-        if secret.data:
-            secret.data = json.loads(Cypher(self.key).decrypt(workspace_key, secret.data))
-        # If has meta decrypt it with workspace_key
-        if secret.blobMeta:
-            secret.blobMeta = json.loads(Cypher(self.key).decrypt(workspace_key, secret.blobMeta))
-
+        secret.set_cypher(self.cypher, workspace_key)
         return secret
 
-    def set_workspace(self, workspace_id, workspace_data):
+    def set_workspace(self, workspace_id, workspace_data, check=False):
         """
         Send workspace contents to existing workspace ID
 
         :param workspace_id: workspace unique ID given by list_workspaces
         :param workspace_data: Python dict with new contents
+        :param check: fail if workspace was modified since it was last read
         """
-        current_workspace_data = self.fetch_json('/api/workspaces/{}'.format(workspace_id))
-        if workspace_data.get('name', None) == None: workspace_data['name'] = current_workspace_data['name']
-        if workspace_data.get('description', None) == None: workspace_data['description'] = current_workspace_data['description']
-        self.fetch_json('/api/workspaces/{}/'.format(workspace_id), http_method='PUT', data=json.dumps(workspace_data))
-
+        self.write_object('workspaces', workspace_id, workspace_data, ('name', 'description'), (), check)
 
-    def set_vault(self, vault_id, vault_data):
+    def set_vault(self, vault_id, vault_data, check=False):
         """
         Send vault contents to existing vault ID
 
         :param vault_id: Vault unique ID given by list_vaults
         :param vault_data: Python dict with new contents
+        :param check: fail if vault was modified since it was last read
         """
-        current_vault_data = self.fetch_json('/api/vaults/{}'.format(vault_id))
-        if vault_data.get('name', None) == None: vault_data['name'] = current_vault_data['name']
-        if vault_data.get('description', None) == None: vault_data['description'] = current_vault_data['description']
-        if vault_data.get('color', None) == None: vault_data['color'] = current_vault_data['color']
-        vault_data['workspace'] = current_vault_data['workspace']
-        self.fetch_json('/api/vaults/{}/'.format(vault_id), http_method='PUT', data=json.dumps(vault_data))
+        # Vaults cannot be moved, workspace is always the current one
+        self.write_object('vaults', vault_id, vault_data, ('name', 'description', 'color'), ('workspace',), check)
 
-    def set_card(self, card_id, card_data):
+    def set_card(self, card_id, card_data, check=False):
         """
         Send card contents to existing card ID
 
         :param card_id: Card unique ID given by list_cards
         :param card_data: Python dict with new contents
+        :param check: fail if card was modified since it was last read
+        """
+        # Cards cannot be moved, vault is always the current one
+        self.write_object('cards', card_id, card_data, ('name', 'description'), ('vault',), check)
+
+    def write_object(self, kind, object_id, data, fields, parents=(), check=False):
+        """
+        Send data to an existing object keeping the fields not given (None)
+
+        When the state of object is known by this client (it was listed, read
+        or written before) the fields not given and the parents are filled
+        from it and the whole object is sent with PUT. Otherwise only the
+        given fields are sent with PATCH and server keeps the rest, so object
+        is never read before the write.
+
+        With check, server state is read and compared with the known state
+        and Conflict is raised if it was modified meanwhile (known state is
+        updated, so the write can be retried). Only the fields present in
+        known state are compared, so a partial state can be set with
+        expect_state.
+
+        :param kind: object kind as in API path (workspaces, vaults or cards)
+        :param object_id: object unique ID
+        :param data: Python dict with new contents
+        :param fields: fields that can be changed in writes
+        :param parents: fields that are always sent with their current value
+        :param check: compare known state with server state
+        """
+        missing = [field for field in fields if data.get(field, None) == None]
+        known = self.known_state(kind, object_id)
+        if check:
+            current = self.fetch_json_uncached('/api/{}/{}'.format(kind, object_id))
+            if known != None and any(field in known and known[field] != current.get(field) for field in fields + parents):
+                self.remember(kind, current)
+                raise Conflict('{0} {1} was modified by someone else'.format(kind[:-1].capitalize(), object_id))
+            self.remember(kind, current)
+            known = current
+        if known == None or any(field not in known for field in missing + list(parents)):
+            http_method = 'PATCH'
+            data = {field: data[field] for field in fields if field not in missing}
+        else:
+            http_method = 'PUT'
+            for field in missing + list(parents):
+                data[field] = known[field]
+        self.remember(kind, self.fetch_json('/api/{}/{}/'.format(kind, object_id), http_method=http_method, data=json.dumps(data)))
+
+    def remember(self, kind, json_obj):
+        """
+        Store the last known state of an object to avoid reading it before writes
+
+        :param kind: object kind as in API path (workspaces, vaults or cards)
+        :param json_obj: object as returned by API
+        """
+        if not isinstance(json_obj, dict) or 'id' not in json_obj:
+            return
+        with self.state_lock:
+            self.state[(kind, json_obj['id'])] = json_obj
+            self.state.move_to_end((kind, json_obj['id']))
+            if len(self.state) > STATE_CACHE_SIZE:
+                self.state.popitem(last=False)
+
+    def known_state(self, kind, object_id):
+        try:
+            key = (kind, int(object_id))
+        except (TypeError, ValueError):
+            # Not a valid ID, server will tell it
+            return None
+        with self.state_lock:
+            return self.state.get(key)
+
+    def expect_state(self, kind, object_id, **fields):
+        """
+        Set the state that an object must have to be written with check
+
+        :param kind: object kind as in API path (workspaces, vaults or cards)
+        :param object_id: object unique ID
+        :param fields: expected values of some fields (as name)
         """
-        current_card_data = self.fetch_json('/api/cards/{}'.format(card_id))
-        if card_data.get('name', None) == None: card_data['name'] = current_card_data['name']
-        if card_data.get('description', None) == None: card_data['description'] = current_card_data['description']
-        card_data['vault'] = current_card_data['vault']
-        self.fetch_json('/api/cards/{}/'.format(card_id), http_method='PUT', data=json.dumps(card_data))
+        try:
+            object_id = int(object_id)
+        except (TypeError, ValueError):
+            err = 'Invalid {0} ID \'{1}\''.format(kind[:-1], object_id)
+            raise SystemExit(err)
+        with self.state_lock:
+            self.state.pop((kind, object_id), None)
+        self.remember(kind, dict(fields, id=object_id))
 
-    def set_secret(self, secret, file=None):
+    def set_secret(self, secret, file=None, workspace_key=None):
         """
         Send secret contents to existing secret ID
 
         :param secret: secret object that contains the data
+        :param workspace_key: key of the workspace that contains the secret (optional, avoids to look for it)
         """
-        vault_id = self.fetch_json('/api/cards/{}'.format(secret.card))['vault']
-        workspace_id = self.fetch_json('/api/vaults/{}'.format(vault_id))['workspace']
-        workspace_key = self.fetch_json('/api/workspaces/{}'.format(workspace_id))['membership']['workspace_key']
-        encrypted_data = Cypher(self.key).encrypt(workspace_key, json.dumps(secret.data))
+        if not workspace_key:
+            workspace_key = self.get_card_workspace_key(secret.card)
+        encrypted_data = self.cypher.encrypt(workspace_key, json.dumps(secret.data))
         data = {
                 'name': secret.name,
                 'type': secret.type,
@@ -257,7 +344,7 @@ class Client(object):
         # Set a new key for the new workspace
         data = {
                 'id': workspace_id,
-                'workspace_key': Cypher(self.key).gen_workspace_key()
+                'workspace_key': self.cypher.gen_workspace_key()
                }
         return self.fetch_json('/api/workspace_keys/{}/'.format(workspace_id), http_method='PUT', data=json.dumps(data))
 
@@ -293,7 +380,7 @@ class Client(object):
         if c_description: data['description'] = c_description
         return self.fetch_json('/api/cards/', http_method='POST', data=json.dumps(data))
 
-    def add_secret(self, card_id, secret_name, json_obj, type='password', file=None):
+    def add_secret(self, card_id, secret_name, json_obj, type='password', file=None, workspace_key=None):
         """
         Create new secret
 
@@ -301,12 +388,12 @@ class Client(object):
         :param secret_name: secret name
         :param json_obj: json object with secret contents
         :param type: type of secret (note, password or file)
+        :param workspace_key: key of the workspace that contains the card (optional, avoids to look for it)
         """
         types = {'note':100, 'password': 200, 'file': 300}
-        vault_id = self.fetch_json('/api/cards/{}'.format(card_id))['vault']
-        workspace_id = self.fetch_json('/api/vaults/{}'.format(vault_id))['workspace']
-        workspace_key = self.fetch_json('/api/workspaces/{}'.format(workspace_id))['membership']['workspace_key']
-        encrypted_data = Cypher(self.key).encrypt(workspace_key, json.dumps(json_obj))
+        if not workspace_key:
+            workspace_key = self.get_card_workspace_key(card_id)
+        encrypted_data = self.cypher.encrypt(workspace_key, json.dumps(json_obj))
         data = {
                 'card': card_id,
                 'type': types[type],
@@ -356,8 +443,8 @@ class Client(object):
             filedata = {'filedata': str(f.read(), "iso-8859-1")}
             filemeta = {'filename': basename(f.name), 'filesize': f.tell()}
             filemeta['filetype'] = MimeTypes().guess_type(f.name)[0] if MimeTypes().guess_type(f.name)[0] else ''
-        encrypted_filedata = Cypher(self.key).encrypt(workspace_key, json.dumps(filedata))
-        encrypted_filemeta = Cypher(self.key).encrypt(workspace_key, json.dumps(filemeta))
+        encrypted_filedata = self.cypher.encrypt(workspace_key, json.dumps(filedata))
+        encrypted_filemeta = self.cypher.encrypt(workspace_key, json.dumps(filemeta))
         files = {'blob_data': ('blob', encrypted_filedata, 'application/octet-stream'), 'blob_meta': (None, encrypted_filemeta)}
         return self.fetch_json('/api/secret_blobs/{}/'.format(secret_id), http_method='PUT', headers={}, files=files)
 
@@ -385,8 +472,10 @@ class Client(object):
         """Fetch JSON from API"""
         if self.verify == False:
             requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+        # Never modify given headers, client can be shared between threads
+        headers = dict(headers)
         headers['X-Vaultier-Token'] = self.token
-        if http_method in ('POST', 'PUT', 'DELETE') and not files:
+        if http_method in ('POST', 'PUT', 'PATCH', 'DELETE') and not files:
             headers['Content-Type'] = 'application/json; charset=utf-8'
 
         """Construct the full URL"""
@@ -394,7 +483,10 @@ class Client(object):
 
         """Perform the HTTP request"""
         try:
-            response = requests.request(http_method, url, params=params, headers=headers, data=data, files=files, verify=self.verify)
+            with tracer.span('{} {}'.format(http_method, uri_path), 'http') as span:
+                response = self.session.request(http_method, url, params=params, headers=headers, data=data, files=files, verify=self.verify)
+                span['status'] = response.status_code
+                span['bytes'] = len(response.content)
         except requests.exceptions.SSLError as e:
             raise SystemExit(e)
 
@@ -51,6 +51,28 @@ class Config(object):
             err = 'vaultcli cannot write in config file.\n{0}'.format(e)
             raise SystemExit(err)
 
+    def profiles(self):
+        """
+        Returns the names of profiles defined in config file
+
+        Every section is a profile, options not set in a section are taken
+        from the default one.
+
+        :rtype: list
+        """
+        return self.config.sections()
+
+    def get_profile(self, profile, option):
+        """
+        Returns a config option value of a profile
+
+        :param profile: profile name, None for default section
+        :param option: option name
+        :return: a config option value
+        :rtype: string
+        """
+        return self.get(profile if profile else 'DEFAULT', option)
+
     def get_default(self, option):
         """
         Returns a config option value into default section of config file
@@ -9,27 +9,39 @@
 
 from vaultcli.workspacecypher import WorkspaceCypher
 from vaultcli.datacypher import DataCypher
+from vaultcli.trace import tracer
+
+from functools import lru_cache
 
 import secrets
 
 class Cypher(object):
     def __init__(self, key):
         self.key = key
+        self.work_space_cypher = WorkspaceCypher(key)
+
+    @lru_cache(maxsize=128)
+    def decrypt_workspace_key(self, workspace_key):
+        """
+        Returns decrypted workspace key
+
+        RSA decryption is the slowest part of every operation, so decrypted
+        keys are cached and shared by all threads using this cypher.
+        """
+        with tracer.span('decrypt workspace key', 'crypto'):
+            return self.work_space_cypher.decrypt(workspace_key)
 
     def decrypt(self, workspace_key, data_encrypted):
-        work_space_cypher = WorkspaceCypher(self.key)
-        decrypted_workspace_key = work_space_cypher.decrypt(workspace_key)
-        data_cypher = DataCypher(decrypted_workspace_key)
-        return data_cypher.decrypt(data_encrypted)
+        data_cypher = DataCypher(self.decrypt_workspace_key(workspace_key))
+        with tracer.span('decrypt', 'crypto', size=len(data_encrypted)):
+            return data_cypher.decrypt(data_encrypted)
 
     def encrypt(self, workspace_key, plain_data):
-        work_space_cypher = WorkspaceCypher(self.key)
-        decrypted_workspace_key = work_space_cypher.decrypt(workspace_key)
-        data_cypher = DataCypher(decrypted_workspace_key)
-        return data_cypher.encrypt(plain_data)
+        data_cypher = DataCypher(self.decrypt_workspace_key(workspace_key))
+        with tracer.span('encrypt', 'crypto', size=len(plain_data)):
+            return data_cypher.encrypt(plain_data)
 
     def gen_workspace_key(self, size=32):
         random_key = (''.join(chr(secrets.randbelow(255)) for _ in range(size))).encode()
-        work_space_cypher = WorkspaceCypher(self.key)
-        new_workspace_key = work_space_cypher.encrypt(random_key)
+        new_workspace_key = self.work_space_cypher.encrypt(random_key)
         return new_workspace_key.decode()
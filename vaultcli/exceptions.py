@@ -22,3 +22,7 @@ class Unauthorized(ResourceUnavailable):
 
 class Forbidden(ResourceUnavailable):
     pass
+
+class Conflict(Exception):
+    """Exception representing an object modified by someone else before a write"""
+    pass
@@ -0,0 +1,412 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2017 Adrián López Tejedor <adrianlzt@gmail.com>
+#                  Óscar García Amor <ogarcia@connectical.com>
+#
+# Distributed under terms of the GNU GPLv3 license.
+
+from vaultcli.trace import tracer
+
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+
+import json
+import os
+import shutil
+import struct
+import time
+import zlib
+
+# Fields needed to copy a ZIP member written by a previous run
+ZIP_INFO_FIELDS = ('compress_type', 'header_offset', 'compress_size', 'file_size')
+
+# Size of the fixed part of a ZIP local file header and of copied chunks
+ZIP_LOCAL_HEADER_SIZE = 30
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def open_json_object(obj, list_name):
+    """
+    Returns the JSON text of a dict up to the opening of a trailing list
+
+    The list items can then be written one by one and closed with ']}'. The
+    result is the same text that json.dump would generate for the full dict.
+
+    :param obj: dict with the scalar fields of the object
+    :param list_name: name of the list that will be streamed
+    :return: JSON text
+    :rtype: string
+    """
+    head = json.dumps(obj)
+    return '{}{}{}: ['.format(head[:-1], ', ' if obj else '', json.dumps(list_name))
+
+class Checkpoint(object):
+    """
+    Class representing the checkpoint manifest of an export
+
+    The manifest is a JSON lines file stored next to the output. First line
+    identifies the export and every other line records a completed vault,
+    card or attached file together with the length of the output files at
+    that moment, so an interrupted export can be truncated back to its last
+    completed unit and continued from there.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = None
+        self.header = None
+        self.vaults = set()
+        self.cards = {}
+        self.attachments = {}
+        self.json_offset = 0
+        self.zip_offset = 0
+
+    def load(self, workspace_id):
+        """
+        Read a previous manifest
+
+        :param workspace_id: workspace that is being exported
+        :return: True if a manifest of the same workspace was found
+        :rtype: bool
+        """
+        try:
+            with open(self.file_name, 'r') as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return False
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Last line can be incomplete if export died writing it
+                break
+        if not records or records[0].get('workspace') != workspace_id:
+            return False
+        self.header = records[0]
+        for record in records[1:]:
+            if 'vault' in record and 'card' not in record:
+                self.vaults.add(record['vault'])
+            elif 'card' in record:
+                self.cards[record['card']] = record['vault']
+            elif 'attachment' in record:
+                self.attachments[record['attachment']] = record['member']
+            if 'json' in record:
+                self.json_offset = record['json']
+            self.zip_offset = record.get('zip', self.zip_offset)
+        return True
+
+    def start(self, workspace_id):
+        """
+        Start a new manifest, discarding any previous one
+
+        :param workspace_id: workspace that is being exported
+        """
+        self.header = {'workspace': workspace_id, 'date_time': list(time.localtime(time.time())[:6])}
+        self.file = open(self.file_name, 'w')
+        self.record(self.header)
+
+    def resume(self):
+        """Continue writing a loaded manifest"""
+        self.file = open(self.file_name, 'a')
+
+    def record(self, data):
+        self.file.write('{}\n'.format(json.dumps(data)))
+        self.file.flush()
+
+    def remove(self):
+        self.file.close()
+        os.remove(self.file_name)
+
+class Exporter(object):
+    """
+    Class for export a workspace in a single pass
+
+    Workspace JSON is written as vaults and cards are completed and attached
+    files go straight to their destination, so memory does not grow with the
+    size of the workspace. Progress is recorded in a checkpoint manifest so
+    an interrupted export can be resumed.
+    """
+    def __init__(self, client, directory, file_name=None, raw=False, resume=False):
+        self.client = client
+        self.directory = os.path.abspath(directory)
+        self.file_name = file_name
+        self.raw = raw
+        self.resume = resume
+        self.zipfile = None
+        self.zip_fp = None
+        self.json_file = None
+        self.counts = {'vaults': 0, 'cards': 0, 'secrets': 0, 'files': 0}
+
+    def export(self, workspace_id):
+        """
+        Export a workspace
+
+        Number of exported vaults, cards, secrets and files are left in
+        counts (units completed by a previous run are not counted when
+        resuming).
+
+        :param workspace_id: workspace unique ID given by list_workspaces
+        """
+        try:
+            workspace = self.client.get_workspace(workspace_id)
+        except Exception as e:
+            raise SystemExit(e)
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except Exception as e:
+                raise SystemExit(e)
+        self.open(workspace)
+        checkpoint = self.checkpoint
+        if checkpoint.json_offset == 0:
+            workspace_data = {
+                    'id': workspace.id,
+                    'name': workspace.name,
+                    'description': workspace.description
+                             }
+            self.write_json(open_json_object(workspace_data, 'vaults'))
+        vaults = self.client.list_vaults(workspace.id)
+        # Vaults with cards already exported are already opened in JSON
+        opened_vaults = set(checkpoint.cards.values())
+        first_vault = True
+        for vault in vaults:
+            if vault.id not in checkpoint.vaults:
+                if vault.id not in opened_vaults:
+                    vault_data = {
+                            'id': vault.id,
+                            'name': vault.name,
+                            'description': vault.description,
+                            'color': vault.color
+                                 }
+                    self.write_json('{}{}'.format('' if first_vault else ', ', open_json_object(vault_data, 'cards')))
+                first_card = vault.id not in opened_vaults
+                cards = self.client.list_cards(vault.id)
+                for card in cards:
+                    if card.id in checkpoint.cards:
+                        continue
+                    card_data = {
+                            'id': card.id,
+                            'name': card.name,
+                            'description': card.description,
+                            'secrets': [self.export_secret(secret, workspace) for secret in self.client.list_secrets(card.id)]
+                                }
+                    self.write_json('{}{}'.format('' if first_card else ', ', json.dumps(card_data)))
+                    first_card = False
+                    self.record({'vault': vault.id, 'card': card.id})
+                    self.counts['cards'] += 1
+                self.write_json(']}')
+                self.record({'vault': vault.id})
+                self.counts['vaults'] += 1
+            first_vault = False
+        self.write_json(']}')
+        self.close()
+
+    def export_secret(self, secret, workspace):
+        """
+        Returns the exportable data of a secret and stores its attached file
+
+        :param secret: secret object with data encrypted
+        :param workspace: workspace object that contains the secret
+        :return: secret data
+        :rtype: dict
+        """
+        secret = self.client.decrypt_secret(secret, workspace.workspaceKey)
+        self.counts['secrets'] += 1
+        secret_data = {
+                'id': secret.id,
+                'name': secret.name,
+                'type': secret.type
+                      }
+        if secret.data: secret_data['data'] = secret.data
+        if secret.blobMeta:
+            secret_data['blob_meta'] = secret.blobMeta
+            if str(secret.id) not in self.checkpoint.attachments:
+                secret_file = self.client.get_file(secret.id)
+                if secret_file != [None, None]:
+                    zinfo = self.write_file(os.path.join(str(secret.id), secret_file[0]), secret_file[1])
+                    self.counts['files'] += 1
+                    member = None
+                    if zinfo:
+                        member = {field: getattr(zinfo, field) for field in ZIP_INFO_FIELDS}
+                        member['filename'] = zinfo.filename
+                    # JSON of this card is not written yet, so keep last JSON offset
+                    self.record({'attachment': str(secret.id), 'member': member}, json=False)
+        return secret_data
+
+    def open(self, workspace):
+        """
+        Open the destination of the export and its checkpoint manifest
+
+        In raw mode JSON is written directly to its final file. Otherwise it
+        is spooled to a '.json.part' file that is added to the ZIP at the end,
+        because a ZIP member cannot stay open while attached files are added.
+        When resuming, both files are truncated to the last completed unit.
+        """
+        self.json_name = '{}.json'.format(workspace.name)
+        if self.raw:
+            json_path = os.path.join(self.directory, self.json_name)
+            checkpoint_path = '{}.checkpoint'.format(json_path)
+        else:
+            if self.file_name == None:
+                zip_filename = '{}.{}'.format(workspace.name, 'zip')
+            else:
+                zip_filename = '{}.{}'.format(self.file_name, 'zip') if os.path.splitext(self.file_name)[1] != '.zip' else self.file_name
+            zip_path = os.path.join(self.directory, zip_filename)
+            json_path = '{}.json.part'.format(zip_path)
+            checkpoint_path = '{}.checkpoint'.format(zip_path)
+        self.checkpoint = Checkpoint(checkpoint_path)
+        try:
+            if self.resume and self.checkpoint.load(workspace.id):
+                self.checkpoint.resume()
+                self.json_file = open(json_path, 'r+')
+                self.json_file.truncate(self.checkpoint.json_offset)
+                self.json_file.seek(self.checkpoint.json_offset)
+                if not self.raw:
+                    self.rebuild_zip(zip_path)
+            else:
+                self.checkpoint.start(workspace.id)
+                self.json_file = open(json_path, 'w+')
+                if not self.raw:
+                    self.zip_fp = open(zip_path, 'w+b')
+                    self.zipfile = ZipFile(self.zip_fp, 'w', ZIP_DEFLATED)
+        except Exception as e:
+            raise SystemExit(e)
+        self.json_path = json_path
+
+    def rebuild_zip(self, zip_path):
+        """
+        Write again into a new ZIP file the members stored by a previous run
+
+        A ZipFile only lists in its central directory the members written
+        through it, so members of the interrupted run are copied one by one
+        from the old file. They are compressed again with the same settings,
+        so the new file is identical to the old one up to the checkpoint and
+        offsets stored in the checkpoint are still valid.
+        """
+        new_path = '{}.rebuild'.format(zip_path)
+        with open(zip_path, 'rb') as old_fp:
+            self.zip_fp = open(new_path, 'w+b')
+            self.zipfile = ZipFile(self.zip_fp, 'w', ZIP_DEFLATED)
+            for member in self.checkpoint.attachments.values():
+                if member:
+                    self.copy_zip_member(old_fp, member)
+        if self.zip_fp.tell() != self.checkpoint.zip_offset:
+            err = 'Cannot resume, \'{}\' does not match its checkpoint. Export again without --resume'.format(zip_path)
+            raise SystemExit(err)
+        os.replace(new_path, zip_path)
+
+    def copy_zip_member(self, old_fp, member):
+        """
+        Copy a member of an old ZIP file, given by its checkpoint fields
+
+        :param old_fp: old ZIP file opened in binary mode
+        :param member: member fields stored in checkpoint manifest
+        """
+        old_fp.seek(member['header_offset'])
+        header = old_fp.read(ZIP_LOCAL_HEADER_SIZE)
+        if len(header) != ZIP_LOCAL_HEADER_SIZE or header[:4] != b'PK\x03\x04':
+            err = 'Cannot resume, member \'{}\' not found in ZIP file. Export again without --resume'.format(member['filename'])
+            raise SystemExit(err)
+        # Local header ends with file name and extra field lengths
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        old_fp.seek(name_length + extra_length, os.SEEK_CUR)
+        zinfo = self.zip_info(member['filename'])
+        zinfo.file_size = member['file_size']
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if member['compress_type'] == ZIP_DEFLATED else None
+        remaining = member['compress_size']
+        with self.zipfile.open(zinfo, 'w') as dest:
+            while remaining:
+                chunk = old_fp.read(min(remaining, COPY_CHUNK_SIZE))
+                if not chunk:
+                    err = 'Cannot resume, member \'{}\' is truncated. Export again without --resume'.format(member['filename'])
+                    raise SystemExit(err)
+                remaining -= len(chunk)
+                dest.write(decompressor.decompress(chunk) if decompressor else chunk)
+            if decompressor:
+                dest.write(decompressor.flush())
+
+    def close(self):
+        """Close the destination of the export and remove the checkpoint"""
+        try:
+            if not self.raw:
+                self.json_file.flush()
+                self.json_file.seek(0)
+                zinfo = self.zip_info(self.json_name)
+                zinfo.file_size = os.fstat(self.json_file.fileno()).st_size
+                with tracer.span('write JSON to ZIP', 'io', size=zinfo.file_size):
+                    with self.zipfile.open(zinfo, 'w') as member:
+                        shutil.copyfileobj(self.json_file.buffer, member)
+                self.zipfile.close()
+                self.zip_fp.close()
+                self.json_file.close()
+                os.remove(self.json_path)
+            else:
+                self.json_file.close()
+            self.checkpoint.remove()
+        except Exception as e:
+            raise SystemExit(e)
+
+    def record(self, data, json=True):
+        """
+        Record a completed unit in checkpoint manifest
+
+        Output files are flushed first so that the stored lengths are safe
+        to truncate to.
+
+        :param data: dict that identifies the completed unit
+        :param json: store also current length of JSON file
+        """
+        try:
+            self.json_file.flush()
+            if json: data['json'] = self.json_file.tell()
+            if not self.raw:
+                self.zip_fp.flush()
+                data['zip'] = self.zip_fp.tell()
+            with tracer.span('write checkpoint', 'io'):
+                self.checkpoint.record(data)
+        except Exception as e:
+            err = 'vaultcli cannot write file.\n{0}'.format(e)
+            raise SystemExit(err)
+
+    def write_json(self, text):
+        try:
+            with tracer.span('write JSON', 'io', size=len(text)):
+                self.json_file.write(text)
+        except Exception as e:
+            err = 'vaultcli cannot write file.\n{0}'.format(e)
+            raise SystemExit(err)
+
+    def write_file(self, file_name, file_contents):
+        """
+        Store an attached file as a ZIP member (or as a file in raw mode)
+
+        :param file_name: path of the file relative to the export
+        :param file_contents: binary data
+        :return: the ZIP member info (None in raw mode)
+        :rtype: ZipInfo
+        """
+        try:
+            with tracer.span('write file', 'io', size=len(file_contents)):
+                if self.raw:
+                    os.makedirs(os.path.join(self.directory, os.path.dirname(file_name)), exist_ok=True)
+                    with open(os.path.join(self.directory, file_name), 'wb') as file:
+                        file.write(file_contents)
+                else:
+                    zinfo = self.zip_info(file_name)
+                    self.zipfile.writestr(zinfo, file_contents)
+                    return zinfo
+        except Exception as e:
+            err = 'vaultcli cannot write file.\n{0}'.format(e)
+            raise SystemExit(err)
+
+    def zip_info(self, file_name):
+        """
+        Returns a ZipInfo for a new member
+
+        All members use the date of the export start, so a resumed export
+        produces the same archive as an uninterrupted one.
+        """
+        zinfo = ZipInfo(file_name, tuple(self.checkpoint.header['date_time']))
+        zinfo.compress_type = ZIP_DEFLATED
+        zinfo.external_attr = 0o644 << 16
+        return zinfo
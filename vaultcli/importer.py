@@ -0,0 +1,690 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2017 Adrián López Tejedor <adrianlzt@gmail.com>
+#                  Óscar García Amor <ogarcia@connectical.com>
+#
+# Distributed under terms of the GNU GPLv3 license.
+
+from vaultcli.secret import Secret
+from vaultcli.views import print_sync_plan
+
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import GeneratorType
+
+import hashlib
+import json
+import os
+import sys
+import threading
+
+SECRET_TYPES = {100: 'note', 200: 'password', 300: 'file'}
+
+# Returned by the tasks of entries that were already stored
+SKIPPED = 'skipped'
+
+class Journal(object):
+    """
+    Record of the entries imported, one JSON line for each of them
+
+    Lines are written as soon as an entry is stored, so the journal is valid
+    even if the import is interrupted.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.entries = {}
+        self.lock = threading.Lock()
+        line = '\n'
+        try:
+            if os.path.exists(file_name):
+                with open(file_name) as file:
+                    for line in file:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # Last line can be incomplete if the import was killed
+                            continue
+                        self.entries[record['uuid']] = record
+            self.file = open(file_name, 'a')
+            if not line.endswith('\n'):
+                self.file.write('\n')
+        except OSError as e:
+            err = 'vaultcli cannot write journal file.\n{0}'.format(e)
+            raise SystemExit(err)
+
+    def get(self, uuid):
+        return self.entries.get(uuid)
+
+    def record(self, uuid, hash, card, secret):
+        record = {'uuid': uuid, 'hash': hash, 'card': card, 'secret': secret}
+        with self.lock:
+            self.entries[uuid] = record
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class Importer(object):
+    """
+    Class for import a workspace exported by vaultcli
+
+    Workspace is created first. Then vaults are created concurrently, cards
+    are created as soon as their vault exists and secrets are encrypted and
+    sent as soon as their card exists, all of it with a pool of 'jobs'
+    threads. Workspace key is resolved once and reused for every secret.
+    """
+    def __init__(self, client, file_name, use_ids=False, jobs=4):
+        self.client = client
+        self.file_name = file_name
+        self.use_ids = use_ids
+        self.jobs = jobs
+        self.aborted = False
+        self.pending = deque()
+        self.imported = 0
+        self.skipped = 0
+        self.imported_lock = threading.Lock()
+        self.card_indexes = {}
+        self.index_lock = threading.Lock()
+
+    def import_workspace(self, data):
+        """
+        Import a workspace
+
+        Lists of vaults, cards and secrets can be generators (as returned by
+        JSONReader), they are consumed while data is being sent.
+
+        :param data: Python dict with the workspace contents
+        """
+        workspace_id = self.create_workspace(data)
+        try:
+            workspace_key = self.client.get_workspace(workspace_id).workspaceKey
+        except Exception as e:
+            raise SystemExit(e)
+        if 'vaults' in data:
+            if not isinstance(data['vaults'], (list, GeneratorType)):
+                err = 'Seems that provided file has not correct format in vaults'
+                raise SystemExit(err)
+            with ThreadPoolExecutor(max_workers=self.jobs) as self.executor:
+                try:
+                    for vault in data['vaults']:
+                        cards = self.get_cards(vault)
+                        vault_future = self.submit(self.create_vault, workspace_id, vault)
+                        for card in cards:
+                            secrets = self.get_secrets(card)
+                            card_future = self.submit(self.create_card, vault_future, card)
+                            for secret in secrets:
+                                self.check_secret(secret)
+                                self.submit(self.create_secret, card_future, secret, workspace_key)
+                    while self.pending:
+                        self.pending.popleft().result()
+                except BaseException as e:
+                    # Let running tasks end and skip the rest
+                    self.aborted = True
+                    raise SystemExit(e)
+
+    def import_entries(self, workspace_id, entries, journal=None):
+        """
+        Import entries read from other password managers into a workspace
+
+        Vaults and cards are looked for by name and created the first time
+        an entry needs them. Secrets are sent as soon as their card exists,
+        using the same pool and ordering than import_workspace, so every
+        format is imported at the same pace.
+
+        With a journal, an interrupted import can be run again: entries
+        already imported and not changed are skipped, changed ones update
+        their secret and the rest are only created if their card has no
+        secret with the same contents.
+
+        :param workspace_id: ID of an existing workspace
+        :param entries: iterable of entries as returned by vaultcli.readers
+        :param journal: Journal of imported entries (optional)
+        """
+        try:
+            workspace_key = self.client.get_workspace(workspace_id).workspaceKey
+            vaults = {vault.name: vault.id for vault in self.client.list_vaults(workspace_id)}
+        except Exception as e:
+            raise SystemExit(e)
+        vault_futures = {}
+        card_futures = {}
+        occurrences = Counter()
+        with ThreadPoolExecutor(max_workers=self.jobs) as self.executor:
+            try:
+                for entry in entries:
+                    if not entry.get('uuid'):
+                        # Entries without UUID are known by their path and
+                        # their position among the entries with that path
+                        path = '/'.join((entry['vault'], entry['card'], entry['name']))
+                        occurrences[path] += 1
+                        entry['uuid'] = path if occurrences[path] == 1 else '{}#{}'.format(path, occurrences[path])
+                    if entry['vault'] not in vault_futures:
+                        vault_futures[entry['vault']] = self.submit(self.find_vault, workspace_id, entry['vault'], vaults)
+                    card_key = (entry['vault'], entry['card'])
+                    if card_key not in card_futures:
+                        card_futures[card_key] = self.submit(self.find_card, vault_futures[entry['vault']], entry['card'])
+                    if journal != None:
+                        future = self.submit(self.store_entry, card_futures[card_key], entry, workspace_key, journal)
+                    else:
+                        future = self.submit(self.create_secret, card_futures[card_key], entry, workspace_key)
+                    future.add_done_callback(self.show_progress)
+                while self.pending:
+                    self.pending.popleft().result()
+            except BaseException as e:
+                # Let running tasks end and skip the rest
+                self.aborted = True
+                raise SystemExit(e)
+            finally:
+                if (self.imported or self.skipped) and sys.stderr.isatty():
+                    print(file=sys.stderr)
+
+    def store_entry(self, card_future, entry, workspace_key, journal):
+        """
+        Create or update the secret of an entry once its card exists, unless
+        the journal or the card show that it is already stored
+        """
+        card_id = card_future.result()
+        if self.aborted: return
+        uuid = entry['uuid']
+        entry_hash, fingerprint = entry_hashes(entry)
+        record = journal.get(uuid)
+        if record and record['hash'] == entry_hash and record['card'] == card_id:
+            return SKIPPED
+        secret_id = None
+        if record and record['secret'] in self.card_index(record['card'], workspace_key)['secrets']:
+            secret_id = record['secret']
+        else:
+            same = self.take_same_secret(card_id, fingerprint, workspace_key)
+            if same != None:
+                journal.record(uuid, entry_hash, card_id, same)
+                return SKIPPED
+        data = normalize_secret_data(entry)
+        attached_file = entry.get('file')
+        if secret_id != None:
+            # Secret is moved to the card of the entry if needed
+            secret = Secret(secret_id, entry['type'], entry['name'], data, {}, card_id)
+            self.client.set_secret(secret, attached_file, workspace_key)
+        else:
+            new_secret = self.client.add_secret(card_id, entry['name'], data, SECRET_TYPES[entry['type']], attached_file, workspace_key)
+            secret_id = new_secret['secret']['id'] if attached_file else new_secret['id']
+        journal.record(uuid, entry_hash, card_id, secret_id)
+
+    def card_index(self, card_id, workspace_key):
+        """
+        Returns the secrets stored in a card before the import
+
+        Card is read only once, the first entry that needs it reads it and
+        the rest wait for it.
+
+        :return: dict with 'secrets' (set of IDs) and 'fingerprints' (dict of
+            fingerprint to list of IDs)
+        :rtype: dict
+        """
+        with self.index_lock:
+            future = self.card_indexes.get(card_id)
+            read = future == None
+            if read:
+                future = self.card_indexes[card_id] = Future()
+        if read:
+            try:
+                index = {'secrets': set(), 'fingerprints': {}}
+                for secret in self.client.list_secrets(card_id):
+                    fingerprint = secret_fingerprint(self.client.decrypt_secret(secret, workspace_key))
+                    index['secrets'].add(secret.id)
+                    index['fingerprints'].setdefault(fingerprint, []).append(secret.id)
+                future.set_result(index)
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def take_same_secret(self, card_id, fingerprint, workspace_key):
+        """
+        Returns the ID of a secret of the card with the same contents, that
+        is not returned again for other entries, or None
+        """
+        same = self.card_index(card_id, workspace_key)['fingerprints'].get(fingerprint)
+        with self.index_lock:
+            return same.pop() if same else None
+
+    def find_vault(self, workspace_id, name, vaults):
+        """
+        Returns the ID of the vault with given name, creating it if needed
+
+        :param vaults: dict of existing vault IDs by name
+        """
+        if self.aborted: return
+        if name in vaults:
+            return vaults[name]
+        return self.client.add_vault(workspace_id, name)['id']
+
+    def find_card(self, vault_future, name):
+        """
+        Returns the ID of the card with given name once its vault exists,
+        creating it if needed
+        """
+        vault_id = vault_future.result()
+        if self.aborted: return
+        for card in self.client.list_cards(vault_id):
+            if card.name == name:
+                return card.id
+        return self.client.add_card(vault_id, name)['id']
+
+    def show_progress(self, future):
+        """Count a secret sent or skipped and show the counts if running in a terminal"""
+        if future.cancelled() or future.exception() != None:
+            return
+        with self.imported_lock:
+            if future.result() == SKIPPED:
+                self.skipped += 1
+            else:
+                self.imported += 1
+            if sys.stderr.isatty():
+                skipped = ', skipped {}'.format(self.skipped) if self.skipped else ''
+                print('\rImported {} secrets{}'.format(self.imported, skipped), end='', file=sys.stderr)
+
+    def submit(self, function, *args):
+        """
+        Run a function in the pool and returns its future
+
+        Only a few tasks are queued for each worker, so data is read from the
+        file at the pace the server accepts it. Failures are raised here.
+        """
+        while len(self.pending) >= self.jobs * 4:
+            self.pending.popleft().result()
+        future = self.executor.submit(function, *args)
+        self.pending.append(future)
+        return future
+
+    def get_cards(self, vault):
+        if 'name' not in vault:
+            err = 'Seems that provided file has not correct format in one vault'
+            raise SystemExit(err)
+        if 'cards' not in vault:
+            return []
+        if not isinstance(vault['cards'], (list, GeneratorType)):
+            err = 'Seems that provided file has not correct format in cards'
+            raise SystemExit(err)
+        return vault['cards']
+
+    def get_secrets(self, card):
+        if 'name' not in card:
+            err = 'Seems that provided file has not correct format in one card'
+            raise SystemExit(err)
+        if 'secrets' not in card:
+            return []
+        if not isinstance(card['secrets'], (list, GeneratorType)):
+            err = 'Seems that provided file has not correct format in secrets'
+            raise SystemExit(err)
+        return card['secrets']
+
+    def check_secret(self, secret):
+        if not isinstance(secret, dict) or 'type' not in secret or 'name' not in secret:
+            err = 'Seems that provided file has not correct format in one secret'
+            raise SystemExit(err)
+
+    def create_workspace(self, data):
+        """
+        Create or update workspace and returns its ID
+        """
+        if self.use_ids:
+            if 'id' in data:
+                workspace_data = {
+                        'id': data['id'],
+                        'name': data['name'],
+                        'description': data.get('description')
+                                 }
+                try:
+                    self.client.set_workspace(data['id'], workspace_data)
+                except Exception as e:
+                    raise SystemExit(e)
+                return data['id']
+            else:
+                err = 'Cannot use workspace ID because not provided in file'
+                raise SystemExit(err)
+        else:
+            try:
+                new_workspace = self.client.add_workspace(data['name'], data.get('description'))
+            except Exception as e:
+                raise SystemExit(e)
+            return new_workspace['workspace']['id']
+
+    def create_vault(self, workspace_id, vault):
+        """
+        Create or update a vault and returns its ID
+        """
+        if self.aborted: return
+        if self.use_ids:
+            if 'id' in vault:
+                vault_data = {
+                        'id': vault['id'],
+                        'name': vault['name'],
+                        'description': vault.get('description'),
+                        'color': vault.get('color')
+                             }
+                self.client.set_vault(vault['id'], vault_data)
+                return vault['id']
+            else:
+                err = 'Cannot use vault ID because not provided in file'
+                raise SystemExit(err)
+        else:
+            return self.client.add_vault(workspace_id, vault['name'], vault.get('description'), vault.get('color'))['id']
+
+    def create_card(self, vault_future, card):
+        """
+        Create or update a card once its vault exists and returns its ID
+        """
+        # Tasks are started in order, so the vault is already being created
+        vault_id = vault_future.result()
+        if self.aborted: return
+        if self.use_ids:
+            if 'id' in card:
+                card_data = {
+                        'id': card['id'],
+                        'name': card['name'],
+                        'description': card.get('description')
+                            }
+                self.client.set_card(card['id'], card_data)
+                return card['id']
+            else:
+                err = 'Cannot use card ID because not provided in file'
+                raise SystemExit(err)
+        else:
+            return self.client.add_card(vault_id, card['name'], card.get('description'))['id']
+
+    def create_secret(self, card_future, secret, workspace_key):
+        """
+        Create or update a secret once its card exists
+        """
+        card_id = card_future.result()
+        if self.aborted: return
+        secret['data'] = normalize_secret_data(secret)
+        attached_file = self.open_attachment(secret)
+        # Secret blob_meta is now unnecesary at this point cause is generated from attached_file
+        secret['blob_meta'] = {}
+        secret['card'] = card_id
+        if self.use_ids:
+            if 'id' in secret:
+                secret_obj = Secret.from_json(secret)
+                if attached_file != '':
+                    self.client.set_secret(secret_obj, attached_file, workspace_key)
+            else:
+                err = 'Cannot use secret ID because not provided in file'
+                raise SystemExit(err)
+        else:
+            if attached_file != '':
+                self.client.add_secret(card_id, secret['name'], secret['data'], SECRET_TYPES[secret['type']], attached_file, workspace_key)
+
+    def open_attachment(self, secret):
+        """
+        Returns the attached file of a secret
+
+        :return: file opened, None if secret has no file or '' if the file
+            cannot be opened (secret must be ignored)
+        """
+        if secret.get('file'):
+            # Entries read from other formats come with their file
+            return secret['file']
+        if secret['type'] == 300 and secret.get('blob_meta') and secret['blob_meta'].get('filename') != None:
+            # Secret has an attached file, try to open it
+            attachments_directory = os.path.dirname(os.path.realpath(self.file_name))
+            attached_file_name = str(secret['blob_meta'].get('filename'))
+            attached_file_path = os.path.join(attachments_directory, str(secret['id']), attached_file_name)
+            try:
+                return open(attached_file_path, 'rb')
+            except Exception as e:
+                print('WARNING: ignoring \'{}\' because cannot attach data, {}'.format(secret['name'], e), file=sys.stderr)
+                return ''
+        return None
+
+    def sync_workspace(self, data, delete=False):
+        """
+        Update a workspace so its contents are the same as in data
+
+        Current contents are read and decrypted from server and compared
+        with data, then only needed creations, updates and (optionally)
+        deletions are sent. A summary of the plan is printed before.
+        Objects are matched by ID; the ones without ID or with an ID that
+        does not exist in server are created.
+
+        :param data: Python dict with the workspace contents (lists can be
+            generators as in import_workspace)
+        :param delete: delete vaults, cards and secrets not present in data
+        """
+        if 'id' not in data:
+            err = 'Cannot use workspace ID because not provided in file'
+            raise SystemExit(err)
+        try:
+            workspace = self.client.get_workspace(data['id'])
+        except Exception as e:
+            raise SystemExit(e)
+        with ThreadPoolExecutor(max_workers=self.jobs) as self.executor:
+            try:
+                server = self.fetch_state(workspace)
+                plan = self.diff(workspace, data, server, delete)
+                print_sync_plan(plan)
+                self.apply(plan, workspace)
+            except BaseException as e:
+                self.aborted = True
+                raise SystemExit(e)
+
+    def fetch_state(self, workspace):
+        """
+        Returns current contents of a workspace
+
+        Secrets are kept as a fingerprint of their decrypted contents, so
+        memory used does not depend on the size of the secrets.
+
+        :return: dict with 'vaults', 'cards' and 'secrets' dicts by ID
+        :rtype: dict
+        """
+        server = {'vaults': {}, 'cards': {}, 'secrets': {}}
+        for vault in self.client.list_vaults(workspace.id):
+            server['vaults'][vault.id] = vault
+        card_lists = self.executor.map(self.client.list_cards, server['vaults'])
+        for cards in card_lists:
+            for card in cards:
+                server['cards'][card.id] = card
+        def fetch_secrets(card_id):
+            secrets = self.client.list_secrets(card_id)
+            return [(secret.id, secret.card, secret_fingerprint(self.client.decrypt_secret(secret, workspace.workspaceKey))) for secret in secrets]
+        for secrets in self.executor.map(fetch_secrets, server['cards']):
+            for secret_id, card_id, fingerprint in secrets:
+                server['secrets'][secret_id] = (card_id, fingerprint)
+        return server
+
+    def diff(self, workspace, data, server, delete=False):
+        """
+        Returns the operations needed to change server contents into data
+
+        Each operation is an (action, kind, object, parent) tuple. Parent is
+        the ID of an existing object or the operation that creates it.
+
+        :rtype: list
+        """
+        plan = []
+        if data.get('name') != workspace.name or data.get('description') != workspace.description:
+            plan.append(('update', 'workspace', {'id': workspace.id, 'name': data.get('name'), 'description': data.get('description')}, None))
+        seen = set()
+        if 'vaults' in data and not isinstance(data['vaults'], (list, GeneratorType)):
+            err = 'Seems that provided file has not correct format in vaults'
+            raise SystemExit(err)
+        for vault in data.get('vaults', []):
+            cards = self.get_cards(vault)
+            vault_data = {
+                    'id': vault.get('id'),
+                    'name': vault['name'],
+                    'description': vault.get('description'),
+                    'color': vault.get('color')
+                         }
+            current = server['vaults'].get(vault.get('id'))
+            vault_exists = current is not None
+            if vault_exists:
+                seen.add(('vault', current.id))
+                vault_parent = current.id
+                if (current.name, current.description, current.color) != (vault_data['name'], vault_data['description'], vault_data['color']):
+                    plan.append(('update', 'vault', vault_data, workspace.id))
+            else:
+                plan.append(('create', 'vault', vault_data, workspace.id))
+                vault_parent = plan[-1]
+            for card in cards:
+                secrets = self.get_secrets(card)
+                card_data = {
+                        'id': card.get('id'),
+                        'name': card['name'],
+                        'description': card.get('description')
+                            }
+                # Contents of new vaults and cards are always new
+                current = server['cards'].get(card.get('id')) if vault_exists else None
+                card_exists = current is not None
+                if card_exists:
+                    seen.add(('card', current.id))
+                    card_parent = current.id
+                    if (current.name, current.description) != (card_data['name'], card_data['description']):
+                        plan.append(('update', 'card', card_data, vault_parent))
+                else:
+                    plan.append(('create', 'card', card_data, vault_parent))
+                    card_parent = plan[-1]
+                for secret in secrets:
+                    self.check_secret(secret)
+                    current = server['secrets'].get(secret.get('id')) if card_exists else None
+                    if current:
+                        seen.add(('secret', secret['id']))
+                        if current != (card_parent, secret_fingerprint(secret)):
+                            plan.append(('update', 'secret', secret, card_parent))
+                    else:
+                        plan.append(('create', 'secret', secret, card_parent))
+        if delete:
+            # Deleting a vault or a card deletes also its contents
+            for vault_id in server['vaults']:
+                if ('vault', vault_id) not in seen:
+                    plan.append(('delete', 'vault', {'id': vault_id}, None))
+            for card_id, card in server['cards'].items():
+                if ('card', card_id) not in seen and ('vault', card.vault) in seen:
+                    plan.append(('delete', 'card', {'id': card_id}, None))
+            for secret_id, (card_id, _) in server['secrets'].items():
+                if ('secret', secret_id) not in seen and ('card', card_id) in seen:
+                    plan.append(('delete', 'secret', {'id': secret_id}, None))
+        return plan
+
+    def apply(self, plan, workspace):
+        """
+        Send the operations of a plan
+
+        Operations run in the pool as soon as the object they depend on
+        exists. Deletions are sent at the end, once secrets that could be
+        moved out of deleted cards are already in place.
+        """
+        futures = {}
+        for operation in plan:
+            action, kind, obj, parent = operation
+            if action == 'delete':
+                continue
+            parent = futures[id(parent)] if isinstance(parent, tuple) else parent
+            futures[id(operation)] = self.submit(self.apply_operation, action, kind, obj, parent, workspace.workspaceKey)
+        while self.pending:
+            self.pending.popleft().result()
+        for action, kind, obj, parent in plan:
+            if action == 'delete':
+                self.submit(getattr(self.client, 'delete_{}'.format(kind)), obj['id'])
+        while self.pending:
+            self.pending.popleft().result()
+
+    def apply_operation(self, action, kind, obj, parent, workspace_key):
+        """
+        Send one operation of a plan and returns the ID of the object
+
+        :param parent: ID of the parent object or future of its creation
+        """
+        if isinstance(parent, Future):
+            parent = parent.result()
+        if self.aborted: return
+        # Updates are checked against the state read by fetch_state, so
+        # changes made by someone else after it are not overwritten
+        if kind == 'workspace':
+            self.client.set_workspace(obj['id'], obj, check=True)
+        elif kind == 'vault':
+            if action == 'create':
+                return self.client.add_vault(parent, obj['name'], obj['description'], obj['color'])['id']
+            self.client.set_vault(obj['id'], obj, check=True)
+        elif kind == 'card':
+            if action == 'create':
+                return self.client.add_card(parent, obj['name'], obj['description'])['id']
+            self.client.set_card(obj['id'], obj, check=True)
+        elif kind == 'secret':
+            data = normalize_secret_data(obj)
+            attached_file = self.open_attachment(obj)
+            if attached_file == '':
+                return
+            if action == 'create':
+                return self.client.add_secret(parent, obj['name'], data, SECRET_TYPES[obj['type']], attached_file, workspace_key)
+            secret = Secret(obj['id'], obj['type'], obj['name'], data, {}, parent)
+            self.client.set_secret(secret, attached_file, workspace_key)
+        return obj['id']
+
+def normalize_secret_data(secret):
+    """
+    Returns secret data with all the fields of its type
+
+    :param secret: Python dict with secret contents as in exported files
+    :rtype: dict
+    """
+    if 'data' not in secret:
+        return {}
+    if secret['type'] == 100:
+        return {'note': secret['data'].get('note', '')}
+    return {
+            'url': secret['data'].get('url', ''),
+            'username': secret['data'].get('username', ''),
+            'password': secret['data'].get('password', ''),
+            'note': secret['data'].get('note', '')
+           }
+
+def secret_fingerprint(secret):
+    """
+    Returns a hash of the contents of a secret
+
+    Attached files are compared by name and size only, to not download them.
+    Data with all its fields empty is the same as no data.
+
+    :param secret: Python dict with secret contents as in exported files or
+        Secret object already decrypted
+    :rtype: string
+    """
+    if isinstance(secret, Secret):
+        secret = {'name': secret.name, 'type': secret.type, 'data': secret.data, 'blob_meta': secret.blobMeta}
+        if not secret['data']: del secret['data']
+    blob_meta = secret.get('blob_meta') or {}
+    data = normalize_secret_data(secret)
+    if not any(data.values()):
+        data = {}
+    contents = [secret['name'], secret['type'], data, blob_meta.get('filename'), blob_meta.get('filesize')]
+    return hashlib.sha256(json.dumps(contents, sort_keys=True).encode('utf-8')).hexdigest()
+
+def entry_hashes(entry):
+    """
+    Returns the hash of an entry read from other password managers and the
+    fingerprint of the secret that stores it
+
+    Server only allows to compare attached files by name and size, so they
+    are left out of the fingerprint, but the hash also includes their
+    contents so the journal detects any change in them.
+
+    :param entry: entry as returned by vaultcli.readers
+    :rtype: tuple
+    """
+    attached_file = entry.get('file')
+    if attached_file == None:
+        fingerprint = secret_fingerprint(entry)
+        return fingerprint, fingerprint
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: attached_file.read(65536), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    attached_file.seek(0)
+    blob_meta = {'filename': os.path.basename(attached_file.name), 'filesize': size}
+    fingerprint = secret_fingerprint({'name': entry['name'], 'type': entry['type'], 'blob_meta': blob_meta})
+    entry_hash = hashlib.sha256((fingerprint + digest.hexdigest()).encode('utf-8')).hexdigest()
+    return entry_hash, fingerprint
@@ -0,0 +1,185 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2017 Adrián López Tejedor <adrianlzt@gmail.com>
+#                  Óscar García Amor <ogarcia@connectical.com>
+#
+# Distributed under terms of the GNU GPLv3 license.
+
+from collections import deque
+from types import GeneratorType
+
+import json
+
+WHITESPACE = ' \t\n\r'
+
+# Longest token that can be cut at the end of buffer (an \uXXXX escape or a
+# partial number), errors before it are not caused by missing data
+TOKEN_MARGIN = 8
+
+class JSONReader(object):
+    """
+    Class for read big JSON files incrementally
+
+    Objects are returned as soon as their fields are read. Their nested
+    lists are returned as generators that parse the file while they are
+    consumed, so only one element of each level is in memory at a time.
+    """
+    def __init__(self, file, chunk_size=65536):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read_object(self, levels=()):
+        """
+        Read a JSON object
+
+        :param levels: list of (list name, required fields) tuples, one for
+            each nesting level. The named list is streamed only when the
+            required fields were already read, otherwise it is read whole so
+            that the object is complete when it is returned.
+        :return: the object, with the streamed list as a generator
+        :rtype: dict
+        """
+        self.expect('{')
+        obj = {}
+        if self.peek() == '}':
+            self.pos += 1
+            return obj
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                self.error('Expecting property name')
+            self.expect(':')
+            if levels and key == levels[0][0] and self.peek() == '[' and all(field in obj for field in levels[0][1]):
+                obj[key] = self.stream_object(obj, levels)
+                return obj
+            obj[key] = self.read_value()
+            if self.next_separator('}'):
+                return obj
+
+    def stream_object(self, obj, levels):
+        """
+        Yields the elements of a list and then reads the rest of its object
+        """
+        yield from self.read_list(levels[1:])
+        if not self.next_separator('}'):
+            while True:
+                key = self.read_value()
+                if not isinstance(key, str):
+                    self.error('Expecting property name')
+                self.expect(':')
+                obj[key] = self.read_value()
+                if self.next_separator('}'):
+                    break
+
+    def read_list(self, levels=()):
+        """
+        Yields the elements of a JSON list
+
+        Elements that are objects are read with read_object, any other value
+        is read whole.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() == '{':
+                element = self.read_object(levels)
+                yield element
+                # Finish reading the element if it was not fully consumed
+                if levels and isinstance(element.get(levels[0][0]), GeneratorType):
+                    deque(element[levels[0][0]], maxlen=0)
+            else:
+                yield self.read_value()
+            if self.next_separator(']'):
+                return
+
+    def read_value(self):
+        """
+        Read a complete JSON value
+
+        Buffer is only refilled when the value may continue in next chunk, so
+        a malformed value fails at once instead of reading the rest of file.
+        """
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # Strings are only unterminated when the buffer ends
+                truncated = e.msg.startswith('Unterminated string') or self.near_end(e.pos)
+                if self.eof or not truncated:
+                    self.pos = e.pos
+                    self.error(e.msg)
+                self.fill(len(self.buffer) - self.pos)
+                continue
+            # A number at the end of buffer can continue in next chunk
+            if self.near_end(end) and not self.eof:
+                self.fill(len(self.buffer) - self.pos)
+                continue
+            self.pos = end
+            return value
+
+    def near_end(self, pos):
+        return pos >= len(self.buffer) - TOKEN_MARGIN
+
+    def next_separator(self, close):
+        """
+        Read a ',' or the closing char of current list or object
+
+        :return: True if closing char was read
+        :rtype: bool
+        """
+        char = self.peek()
+        self.pos += 1
+        if char == close:
+            return True
+        if char != ',':
+            self.pos -= 1
+            self.error('Expecting \',\' delimiter')
+        return False
+
+    def expect(self, char):
+        if self.peek() != char:
+            self.error('Expecting \'{}\''.format(char))
+        self.pos += 1
+
+    def peek(self):
+        self.skip_whitespace()
+        if self.pos >= len(self.buffer):
+            self.error('Unexpected end of file')
+        return self.buffer[self.pos]
+
+    def skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return
+            self.fill()
+
+    def fill(self, size=0):
+        """
+        Read more data from file, discarding data already parsed
+
+        :param size: read at least this size, so values that are bigger than
+            a chunk are read in a few steps
+        """
+        self.buffer = self.buffer[self.pos:]
+        self.offset += self.pos
+        self.pos = 0
+        chunk = self.file.read(max(self.chunk_size, size))
+        if not chunk:
+            self.eof = True
+        self.buffer += chunk
+
+    def error(self, msg):
+        err = 'vaultcli cannot read json file.\n{0}: char {1}'.format(msg, self.offset + self.pos)
+        raise SystemExit(err)
@@ -10,16 +10,29 @@
 from vaultcli.auth import Auth
 from vaultcli.client import Client
 from vaultcli.config import Config
-from vaultcli.secret import Secret
-from vaultcli.views import print_tree, print_workspaces, print_vaults, print_cards, print_secrets, print_secret
+from vaultcli.exporter import Exporter
+from vaultcli.importer import Importer, Journal
+from vaultcli.jsonreader import JSONReader
+from vaultcli.readers import READERS
+from vaultcli.workspace import Workspace
+from vaultcli.vault import Vault
+from vaultcli.card import Card
+from vaultcli.views import print_tree, print_workspaces, print_profiles_workspaces, print_vaults, print_cards, print_secrets, print_secret
 from vaultcli.helpers import query_yes_no
+from vaultcli.trace import tracer
 
-from zipfile import ZipFile, ZIP_DEFLATED
+from concurrent.futures import ThreadPoolExecutor
 
 import argparse
+import cProfile
+import io
 import json
 import os
+import pstats
+import requests
 import sys
+import threading
+import time
 
 def get_config_file(args):
     if args.config:
@@ -78,27 +91,51 @@ def write_binary_file(file_name, file_contents):
         err = 'vaultcli cannot write file.\n{0}'.format(e)
         raise SystemExit(err)
 
-def write_json_file(file_name, file_contents):
-    try:
-        with open(file_name, 'w') as file:
-            json.dump(file_contents, file)
-    except Exception as e:
-        err = 'vaultcli cannot write file.\n{0}'.format(e)
+def get_profiles(args):
+    """
+    Returns the profiles selected with --profile, [None] if no one was
+    selected (default section is used)
+    """
+    if not getattr(args, 'profiles', None):
+        return [None]
+    config_file = get_config_file(args)
+    available = Config(config_file).profiles()
+    if args.profiles == 'all':
+        profiles = available
+    else:
+        profiles = [profile.strip() for profile in args.profiles.split(',') if profile.strip()]
+    if not profiles:
+        err = 'No profiles defined in config file \'{}\'.'.format(config_file)
         raise SystemExit(err)
+    unknown = [profile for profile in profiles if profile not in available]
+    if unknown:
+        err = 'Profiles not found in config file \'{}\': {}'.format(config_file, ', '.join(unknown))
+        raise SystemExit(err)
+    return profiles
 
-def configure_client(args):
+def configure_client(args, profile=None):
     # Get config in object
     config_file = get_config_file(args)
     config = Config(config_file)
 
+    if profile == None:
+        profiles = get_profiles(args)
+        if len(profiles) > 1:
+            err = 'Command {} can only use one profile'.format(args.command)
+            raise SystemExit(err)
+        profile = profiles[0]
+
     # Get config vaules from config file
-    email = config.get_default('email')
-    server = config.get_default('server')
-    key = config.get_default('key')
+    email = config.get_profile(profile, 'email')
+    server = config.get_profile(profile, 'server')
+    key = config.get_profile(profile, 'key')
 
     # Check if main values have data
     if not email or not server or not key:
-        err = 'Your config file \'{}\' is invalid, please check it.'.format(config_file)
+        if profile:
+            err = 'Your config file \'{}\' is invalid in profile \'{}\', please check it.'.format(config_file, profile)
+        else:
+            err = 'Your config file \'{}\' is invalid, please check it.'.format(config_file)
         raise SystemExit(err)
 
     try:
@@ -110,262 +147,179 @@ def configure_client(args):
     if args.insecure:
         verify = False
     else:
-        if config.get_default('verify') == None:
+        if config.get_profile(profile, 'verify') == None:
             verify = True
         else:
-            verify = False if config.get_default('verify').lower() == 'false' else config.get_default('verify')
+            verify = False if config.get_profile(profile, 'verify').lower() == 'false' else config.get_profile(profile, 'verify')
 
     token = Auth(server, email, key, verify).get_token()
     return Client(server, token, key, verify)
 
+def fan_out(args, function, show):
+    """
+    Run a command in every selected profile at the same time
+
+    Every profile has its own client (session and token). Results are shown
+    together once all profiles answered, and profiles that failed are
+    reported at the end.
+
+    :param function: function that receives a client and returns a result
+    :param show: function that receives the list of (profile, result)
+    """
+    profiles = get_profiles(args)
+    def run(profile):
+        try:
+            return profile, function(configure_client(args, profile)), None
+        except (Exception, SystemExit) as e:
+            return profile, None, e
+    with ThreadPoolExecutor(max_workers=len(profiles)) as executor:
+        results = list(executor.map(run, profiles))
+    show([(profile, result) for profile, result, error in results if error == None])
+    failed = [profile for profile, result, error in results if error != None]
+    for profile, result, error in results:
+        if error != None:
+            print('ERROR: profile \'{}\', {}'.format(profile, error), file=sys.stderr)
+    if failed:
+        err = 'Command failed in {} of {} profiles: {}'.format(len(failed), len(profiles), ', '.join(failed))
+        raise SystemExit(err)
+
 def import_workspace(args):
-    try:
-        with args.file as file:
-            data = json.load(file)
-    except Exception as e:
-        err = 'vaultcli cannot read json file.\n{0}'.format(e)
+    if args.jobs < 1:
+        err = 'Number of jobs must be at least 1'
         raise SystemExit(err)
-    if 'name' in data:
-        client = configure_client(args)
-        if args.use_ids:
-            if 'id' in data:
-                workspace_data = {
-                        'id': data['id'],
-                        'name': data['name'],
-                        'description': data.get('description')
-                                 }
-                try:
-                    client.set_workspace(data['id'], workspace_data)
-                except Exception as e:
-                    raise SystemExit(e)
+    if args.delete and not args.sync:
+        err = 'Option --delete can only be used with --sync'
+        raise SystemExit(err)
+    with args.file as file:
+        # Stream lists only when the fields needed to create their parent were already read
+        data = JSONReader(file).read_object([
+            ('vaults', ('id', 'name', 'description')),
+            ('cards', ('id', 'name', 'description', 'color')),
+            ('secrets', ('id', 'name', 'description'))
+            ])
+        if 'name' in data:
+            client = configure_client(args)
+            importer = Importer(client, file.name, args.use_ids, args.jobs)
+            if args.sync:
+                importer.sync_workspace(data, args.delete)
             else:
-                err = 'Cannot use workspace ID because not provided in file'
-                raise SystemExit(err)
+                importer.import_workspace(data)
         else:
-            try:
-                new_workspace = client.add_workspace(data['name'], data.get('description'))
-            except Exception as e:
-                raise SystemExit(e)
-        if 'vaults' in data:
-            if isinstance(data['vaults'], list):
-                for vault in data['vaults']:
-                    if 'name' in vault:
-                        if args.use_ids:
-                            if 'id' in vault:
-                                vault_data = {
-                                        'id': vault['id'],
-                                        'name': vault['name'],
-                                        'description': vault.get('description'),
-                                        'color': vault.get('color')
-                                             }
-                                try:
-                                    client.set_vault(vault['id'], vault_data)
-                                except Exception as e:
-                                    raise SystemExit(e)
-                            else:
-                                err = 'Cannot use vault ID because not provided in file'
-                                raise SystemExit(err)
-                        else:
-                            try:
-                                new_vault = client.add_vault(new_workspace['workspace']['id'], vault['name'], vault.get('description'), vault.get('color'))
-                            except Exception as e:
-                                raise SystemExit(e)
-                        if 'cards' in vault:
-                            if isinstance(vault['cards'], list):
-                                for card in vault['cards']:
-                                    if 'name' in card:
-                                        if args.use_ids:
-                                            if 'id' in card:
-                                                card_data = {
-                                                        'id': card['id'],
-                                                        'name': card['name'],
-                                                        'description': card.get('description')
-                                                            }
-                                                client.set_card(card['id'], card_data)
-                                            else:
-                                                err = 'Cannot use card ID because not provided in file'
-                                                raise SystemExit(err)
-                                        else:
-                                            try:
-                                                new_card = client.add_card(new_vault['id'], card['name'], card.get('description'))
-                                            except Exception as e:
-                                                raise SystemExit(e)
-                                        if 'secrets' in card:
-                                            if isinstance(card['secrets'], list):
-                                                for secret in card['secrets']:
-                                                    if ('type' and 'name') in secret:
-                                                        if 'data' in secret:
-                                                            # Complete missing data
-                                                            if secret['type'] == 100:
-                                                                secret_data = {'note': secret['data'].get('note', '')}
-                                                            else:
-                                                                secret_data = {
-                                                                        'url': secret['data'].get('url', ''),
-                                                                        'username': secret['data'].get('username', ''),
-                                                                        'password': secret['data'].get('password', ''),
-                                                                        'note': secret['data'].get('note', '')
-                                                                              }
-                                                            secret['data'] = secret_data
-                                                        else:
-                                                            secret['data'] = {}
-                                                        if secret['type'] == 300 and 'blob_meta' in secret and secret['blob_meta'].get('filename') != None:
-                                                            # Secret has an attached file, try to open it
-                                                            attachments_directory = os.path.dirname(os.path.realpath(args.file.name))
-                                                            attached_file_name = str(secret['blob_meta'].get('filename'))
-                                                            attached_file_path = os.path.join(attachments_directory, str(secret['id']), attached_file_name)
-                                                            try:
-                                                                attached_file = open(attached_file_path, 'rb')
-                                                            except Exception as e:
-                                                                print('WARNING: ignoring \'{}\' because cannot attach data, {}'.format(secret['name'], e), file=sys.stderr)
-                                                                attached_file = ''
-                                                        else:
-                                                            attached_file = None
-                                                        # Secret blob_meta is now unnecesary at this point cause is generated from attached_file
-                                                        secret['blob_meta'] = {}
-                                                        secret['card'] = card['id']
-                                                        if args.use_ids:
-                                                            if 'id' in secret:
-                                                                secret_obj = Secret.from_json(secret)
-                                                                if attached_file != '':
-                                                                    try:
-                                                                        client.set_secret(secret_obj, attached_file)
-                                                                    except Exception as e:
-                                                                        raise SystemExit(e)
-                                                            else:
-                                                                err = 'Cannot use secret ID because not provided in file'
-                                                                raise SystemExit(err)
-                                                        else:
-                                                            if attached_file != '':
-                                                                types = {100: 'note', 200: 'password', 300: 'file'}
-                                                                try:
-                                                                    client.add_secret(new_card['id'], secret['name'], secret['data'], types[secret['type']], attached_file)
-                                                                except Exception as e:
-                                                                    raise SystemExit(e)
-                                                    else:
-                                                        err = 'Seems that provided file has not correct format in one secret'
-                                                        raise SystemExit(err)
-                                            else:
-                                                err = 'Seems that provided file has not correct format in secrets'
-                                                raise SystemExit(err)
-                                    else:
-                                        err = 'Seems that provided file has not correct format in one card'
-                                        raise SystemExit(err)
-                            else:
-                                err = 'Seems that provided file has not correct format in cards'
-                                raise SystemExit(err)
-                    else:
-                        err = 'Seems that provided file has not correct format in one vault'
-                        raise SystemExit(err)
-            else:
-                err = 'Seems that provided file has not correct format in vaults'
-                raise SystemExit(err)
-    else:
-        err = 'Seems that provided file has not correct format'
+            err = 'Seems that provided file has not correct format'
+            raise SystemExit(err)
+
+def import_entries(args):
+    if args.jobs < 1:
+        err = 'Number of jobs must be at least 1'
         raise SystemExit(err)
+    entries = READERS[args.format](args.file, args.password)
+    client = configure_client(args)
+    # Allow one connection for each worker in the shared session
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.jobs)
+    client.session.mount('http://', adapter)
+    client.session.mount('https://', adapter)
+    journal = Journal(args.journal) if args.journal else None
+    try:
+        Importer(client, args.file, jobs=args.jobs).import_entries(args.id, entries, journal)
+    finally:
+        if journal != None:
+            journal.close()
 
 def export_workspace(args):
     client = configure_client(args)
-    try:
-        workspace = client.get_workspace(args.id)
-    except Exception as e:
-        raise SystemExit(e)
+    Exporter(client, args.directory, args.file, args.raw, args.resume).export(args.id)
+
+def export_all(args):
+    if args.jobs < 1:
+        err = 'Number of jobs must be at least 1'
+        raise SystemExit(err)
     directory = os.path.abspath(args.directory)
     if not os.path.isdir(directory):
         try:
             os.makedirs(directory)
         except Exception as e:
             raise SystemExit(e)
-    if not args.raw:
-        if args.file == None:
-            zip_filename = '{}.{}'.format(workspace.name, 'zip')
-        else:
-            zip_filename = '{}.{}'.format(args.file, 'zip') if os.path.splitext(args.file)[1] != '.zip' else args.file
-        try:
-            zipfile = ZipFile(os.path.join(directory, zip_filename), 'w', ZIP_DEFLATED)
-        except Exception as e:
-            raise SystemExit(e)
-    workspace_data = {
-            'id': workspace.id,
-            'name': workspace.name,
-            'description': workspace.description,
-            'vaults': []
-                     }
-    vaults = client.list_vaults(args.id)
-    for vault in vaults:
-        vault_data = {
-                'id': vault.id,
-                'name': vault.name,
-                'description': vault.description,
-                'color': vault.color,
-                'cards': []
-                     }
-        cards = client.list_cards(vault.id)
-        for card in cards:
-            card_data = {
-                    'id': card.id,
-                    'name': card.name,
-                    'description': card.description,
-                    'secrets': []
-                        }
-            secrets = client.list_secrets(card.id)
-            for secret in secrets:
-                secret = client.decrypt_secret(secret, workspace.workspaceKey)
-                secret_data = {
-                        'id': secret.id,
-                        'name': secret.name,
-                        'type': secret.type
-                              }
-                if secret.data: secret_data['data'] = secret.data
-                if secret.blobMeta:
-                    secret_data['blob_meta'] = secret.blobMeta
-                    secret_file = client.get_file(secret.id)
-                    if secret_file != [None, None]:
-                        try:
-                            os.makedirs(os.path.join(directory, str(secret.id)), exist_ok=True)
-                            file_name = os.path.join(directory, str(secret.id), secret_file[0])
-                            write_binary_file(file_name, secret_file[1])
-                        except Exception as e:
-                            raise SystemExit(e)
-                        if not args.raw:
-                            zipfile.write(file_name, os.path.join(str(secret.id), secret_file[0]))
-                            os.remove(file_name)
-                            os.rmdir(os.path.join(directory, str(secret.id)))
-                card_data['secrets'].append(secret_data)
-            vault_data['cards'].append(card_data)
-        workspace_data['vaults'].append(vault_data)
-    json_file = os.path.join(directory, '{}.json'.format(workspace.name))
+    client = configure_client(args)
+    # Allow one connection for each worker in the shared session
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.jobs)
+    client.session.mount('http://', adapter)
+    client.session.mount('https://', adapter)
     try:
-        write_json_file(json_file, workspace_data)
+        workspaces = client.list_workspaces()
     except Exception as e:
         raise SystemExit(e)
-    if not args.raw:
-        zipfile.write(json_file, '{}.json'.format(workspace.name))
-        os.remove(json_file)
-        zipfile.close()
 
-def tree_workspace(args):
-    client = configure_client(args)
-    vault_list = []
+    def export(workspace):
+        exporter = Exporter(client, directory, '{}-{}'.format(workspace.id, workspace.name), resume=args.resume)
+        summary = {'id': workspace.id, 'name': workspace.name, 'file': '{}-{}.zip'.format(workspace.id, workspace.name)}
+        start = time.time()
+        try:
+            exporter.export(workspace.id)
+            summary['status'] = 'ok'
+        except (Exception, SystemExit) as e:
+            print('ERROR: cannot export workspace \'{}\', {}'.format(workspace.name, e), file=sys.stderr)
+            summary['status'] = 'error'
+            summary['error'] = str(e)
+        summary['seconds'] = round(time.time() - start, 3)
+        summary.update(exporter.counts)
+        return summary
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        workspaces_summary = list(executor.map(export, workspaces))
+    summary = {
+            'server': client.server,
+            'seconds': round(time.time() - start, 3),
+            'workspaces': workspaces_summary
+              }
     try:
-        workspace_name = client.get_workspace(args.id).name
+        with open(os.path.join(directory, 'export-all.json'), 'w') as file:
+            json.dump(summary, file, indent=2)
     except Exception as e:
-        raise SystemExit(e)
-    vaults = client.list_vaults(args.id)
-    for vault in vaults:
-        card_list = []
-        cards = client.list_cards(vault.id)
-        for card in cards:
-            secret_list = []
-            secrets = client.list_secrets(card.id)
-            for secret in secrets:
-                secret_list.append('{}: {}'.format(secret.name, secret.id))
-            card_list.append(['{}: {}'.format(card.name, card.id), secret_list])
-        vault_list.append(['{}: {}'.format(vault.name, vault.id), card_list])
-    print_tree([workspace_name, vault_list])
+        err = 'vaultcli cannot write file.\n{0}'.format(e)
+        raise SystemExit(err)
+    failed = [workspace['name'] for workspace in workspaces_summary if workspace['status'] != 'ok']
+    if failed:
+        err = 'Cannot export {} of {} workspaces: {}'.format(len(failed), len(workspaces_summary), ', '.join(failed))
+        raise SystemExit(err)
+
+def tree_workspace(args):
+    def tree(client, file=None):
+        try:
+            workspace = client.get_workspace(args.id)
+        except Exception as e:
+            raise SystemExit(e)
+        def get_children(node):
+            if isinstance(node, Workspace):
+                return client.list_vaults(node.id)
+            if isinstance(node, Vault):
+                return client.list_cards(node.id)
+            if isinstance(node, Card):
+                return client.list_secrets(node.id)
+            return []
+        print_tree(workspace, get_children, file)
+    if len(get_profiles(args)) > 1:
+        # Trees are crawled at the same time and printed one after another
+        def crawl(client):
+            output = io.StringIO()
+            tree(client, output)
+            return output.getvalue()
+        def show(results):
+            for profile, output in results:
+                print('[{}]'.format(profile))
+                print(output, end='')
+        fan_out(args, crawl, show)
+    else:
+        tree(configure_client(args))
 
 def list_workspaces(args):
-    client = configure_client(args)
-    print_workspaces(client.list_workspaces())
+    if len(get_profiles(args)) > 1:
+        def show(results):
+            print_profiles_workspaces([(profile, workspace) for profile, workspaces in results for workspace in workspaces])
+        fan_out(args, lambda client: client.list_workspaces(), show)
+    else:
+        client = configure_client(args)
+        print_workspaces(client.list_workspaces())
 
 def list_vaults(args):
     client = configure_client(args)
@@ -381,32 +335,33 @@ def list_secrets(args):
 
 def show_secret(args):
     client = configure_client(args)
+    # Data and meta are decrypted when they are shown, errors are reported as before
     try:
         secret = client.get_secret(args.id)
+        if (
+                args.url or args.username or args.password or args.note or
+                args.name or args.file_name or args.file_size or args.type
+           ):
+            if args.url or args.username or args.password or args.note:
+                if secret.data:
+                    if args.url: print(secret.data.get('url', 'no data'))
+                    if args.username: print(secret.data.get('username', 'no data'))
+                    if args.password: print(secret.data.get('password', 'no data'))
+                    if args.note: print(secret.data.get('note', 'no data'))
+                else:
+                    print('Empty secret')
+            if args.name: print(secret.name)
+            if args.file_name or args.file_size:
+                if secret.blobMeta:
+                    if args.file_name: print(secret.blobMeta.get('filename', 'no data'))
+                    if args.file_size: print(secret.blobMeta.get('filesize', 'no data'))
+                else:
+                    print('No file')
+            if args.type: print(secret.type)
+        else:
+            print_secret(secret)
     except Exception as e:
         raise SystemExit(e)
-    if (
-            args.url or args.username or args.password or args.note or
-            args.name or args.file_name or args.file_size or args.type
-       ):
-        if args.url or args.username or args.password or args.note:
-            if secret.data:
-                if args.url: print(secret.data.get('url', 'no data'))
-                if args.username: print(secret.data.get('username', 'no data'))
-                if args.password: print(secret.data.get('password', 'no data'))
-                if args.note: print(secret.data.get('note', 'no data'))
-            else:
-                print('Empty secret')
-        if args.name: print(secret.name)
-        if args.file_name or args.file_size:
-            if secret.blobMeta:
-                if args.file_name: print(secret.blobMeta.get('filename', 'no data'))
-                if args.file_size: print(secret.blobMeta.get('filesize', 'no data'))
-            else:
-                print('No file')
-        if args.type: print(secret.type)
-    else:
-        print_secret(secret)
 
 def get_file(args):
     client = configure_client(args)
@@ -439,8 +394,10 @@ def edit_workspace(args):
             'name': args.name,
             'description': args.description
                 }
+    if args.if_name != None:
+        client.expect_state('workspaces', args.id, name=args.if_name)
     try:
-        client.set_workspace(args.id, workspace_data)
+        client.set_workspace(args.id, workspace_data, check=args.if_name != None)
     except Exception as e:
         raise SystemExit(e)
 
@@ -455,8 +412,10 @@ def edit_vault(args):
             'description': args.description,
             'color': args.color
                  }
+    if args.if_name != None:
+        client.expect_state('vaults', args.id, name=args.if_name)
     try:
-        client.set_vault(args.id, vault_data)
+        client.set_vault(args.id, vault_data, check=args.if_name != None)
     except Exception as e:
         raise SystemExit(e)
 
@@ -470,8 +429,10 @@ def edit_card(args):
             'name': args.name,
             'description': args.description
                 }
+    if args.if_name != None:
+        client.expect_state('cards', args.id, name=args.if_name)
     try:
-        client.set_card(args.id, card_data)
+        client.set_card(args.id, card_data, check=args.if_name != None)
     except Exception as e:
         raise SystemExit(e)
 
@@ -491,14 +452,14 @@ def edit_secret(args):
         err = 'Sorry, but secret passwords cannot handle files.'
         raise SystemExit(err)
     else:
-        if not secret.data:
-            secret.data = {}
-        if args.url != None: secret.data['url'] = args.url
-        if args.username != None: secret.data['username'] = args.username
-        if args.password != None: secret.data['password'] = args.password
-        if args.note != None: secret.data['note'] = args.note
-        if args.name != None: secret.name = args.name
         try:
+            if not secret.data:
+                secret.data = {}
+            if args.url != None: secret.data['url'] = args.url
+            if args.username != None: secret.data['username'] = args.username
+            if args.password != None: secret.data['password'] = args.password
+            if args.note != None: secret.data['note'] = args.note
+            if args.name != None: secret.name = args.name
             client.set_secret(secret, args.file)
         except Exception as e:
             raise SystemExit(e)
@@ -586,11 +547,57 @@ def delete_workspace(args):
     except Exception as e:
         raise SystemExit(e)
 
+def run_profiled(args):
+    """
+    Run the command under cProfile and report where time was spent
+
+    Threads started by the command (jobs of import, export or profiles) get
+    their own profiler and all of them are merged in the same stats.
+    """
+    profile_file = args.profile_stats if args.profile_stats else 'vaultcli-{}.prof'.format(args.command)
+    profiler = cProfile.Profile()
+    thread_profilers = []
+    def profile_thread(frame, event, arg):
+        sys.setprofile(None)
+        thread_profiler = cProfile.Profile()
+        try:
+            thread_profiler.enable()
+        except ValueError:
+            # Since Python 3.12 one profiler already sees all threads
+            return
+        thread_profilers.append(thread_profiler)
+    threading.setprofile(profile_thread)
+    try:
+        profiler.runcall(args.func, args)
+    except BaseException:
+        # Do not hide the error of the command if stats cannot be saved
+        try:
+            save_profile(profile_file, profiler, thread_profilers)
+        except SystemExit as e:
+            print(e, file=sys.stderr)
+        raise
+    finally:
+        threading.setprofile(None)
+    save_profile(profile_file, profiler, thread_profilers)
+
+def save_profile(profile_file, profiler, thread_profilers):
+    stats = pstats.Stats(profiler, *thread_profilers, stream=sys.stderr)
+    stats.sort_stats('cumulative').print_stats(25)
+    try:
+        stats.dump_stats(profile_file)
+    except Exception as e:
+        err = 'vaultcli cannot write file.\n{0}'.format(e)
+        raise SystemExit(err)
+    print('Profile stats saved to \'{}\''.format(profile_file), file=sys.stderr)
+
 def main():
     """Create an arparse and subparse to manage commands"""
     parser = argparse.ArgumentParser(description='Manage your Vaultier secrets from cli.')
     parser.add_argument('-c', '--config', metavar='file', help='custom configuration file')
     parser.add_argument('-k', '--insecure', action='store_true', help='allow SSL server connection without certs')
+    parser.add_argument('--profile-stats', metavar='file', nargs='?', const='', help='profile the command with cProfile and save stats to file (by default vaultcli-<command>.prof)')
+    parser.add_argument('--trace', metavar='file', help='save a timeline of the command to file in Chrome trace format')
+    parser.add_argument('--profile', metavar='profiles', dest='profiles', help='comma separated config profiles to use, or \'all\' (list-workspaces and tree-workspace run in all of them at the same time)')
     subparsers = parser.add_subparsers(metavar='', dest='command')
     subparsers.required = True
 
@@ -612,14 +619,35 @@ def main():
     parser_export_workspace_exclusive_arguments = parser_export_workspace.add_mutually_exclusive_group()
     parser_export_workspace_exclusive_arguments.add_argument('-f', '--file', metavar='filename', help='exported zip file name (by default use workspace name)')
     parser_export_workspace_exclusive_arguments.add_argument('--raw', action='store_true', help='export as files instead of zip')
+    parser_export_workspace.add_argument('--resume', action='store_true', help='continue an interrupted export from its checkpoint')
     parser_export_workspace.set_defaults(func=export_workspace)
 
+    """Add all options for export all command"""
+    parser_export_all = subparsers.add_parser('export-all', help='Export all workspaces to ZIP files')
+    parser_export_all.add_argument('directory', metavar='directory' , help='output directory (will be created if not exists)')
+    parser_export_all.add_argument('-j', '--jobs', metavar='jobs', type=int, default=4, help='number of workspaces exported at the same time (default 4)')
+    parser_export_all.add_argument('--resume', action='store_true', help='continue interrupted exports from their checkpoints')
+    parser_export_all.set_defaults(func=export_all)
+
     """Add all options for import command"""
     parser_import_workspace = subparsers.add_parser('import-workspace', help='Import a workspace from a JSON file')
     parser_import_workspace.add_argument('file', metavar='file', type=argparse.FileType('r'), help='file itself')
     parser_import_workspace.add_argument('-i', '--use-ids', action='store_true', help='try to use IDs to modify existing data')
+    parser_import_workspace.add_argument('-s', '--sync', action='store_true', help='use IDs to send only the changes from existing data')
+    parser_import_workspace.add_argument('--delete', action='store_true', help='with --sync, delete existing data not present in file')
+    parser_import_workspace.add_argument('-j', '--jobs', metavar='jobs', type=int, default=4, help='number of requests sent at the same time (default 4)')
     parser_import_workspace.set_defaults(func=import_workspace)
 
+    """Add all options for import from other formats command"""
+    parser_import = subparsers.add_parser('import', help='Import secrets from other password managers to a workspace')
+    parser_import.add_argument('id', metavar='id', help='workspace id')
+    parser_import.add_argument('file', metavar='file', help='file exported by the password manager')
+    parser_import.add_argument('-f', '--format', choices=sorted(READERS), required=True, help='format of file')
+    parser_import.add_argument('-p', '--password', metavar='password', help='password of keepass file (asked if not given)')
+    parser_import.add_argument('-j', '--jobs', metavar='jobs', type=int, default=4, help='number of requests sent at the same time (default 4)')
+    parser_import.add_argument('--journal', metavar='file', help='record imported entries in file, so an interrupted import can be run again')
+    parser_import.set_defaults(func=import_entries)
+
     """Add all options for list workspaces command"""
     parser_list_workspaces = subparsers.add_parser('list-workspaces', help='List Vaultier workspaces')
     parser_list_workspaces.set_defaults(func=list_workspaces)
@@ -663,6 +691,7 @@ def main():
     parser_edit_workspace.add_argument('id', metavar='id', help='workspace id')
     parser_edit_workspace.add_argument('-n', '--name', metavar='name', help='workspace name')
     parser_edit_workspace.add_argument('-d', '--description', metavar='description', help='workspace description')
+    parser_edit_workspace.add_argument('--if-name', metavar='name', help='only edit if current workspace name is this one')
     parser_edit_workspace.set_defaults(func=edit_workspace)
 
     """Add all options for edit vault command"""
@@ -671,6 +700,7 @@ def main():
     parser_edit_vault.add_argument('-n', '--name', metavar='name', help='vault name')
     parser_edit_vault.add_argument('-d', '--description', metavar='description', help='vault description')
     parser_edit_vault.add_argument('--color', choices=['blue', 'orange', 'purple', 'green', 'red'], help='vault color')
+    parser_edit_vault.add_argument('--if-name', metavar='name', help='only edit if current vault name is this one')
     parser_edit_vault.set_defaults(func=edit_vault)
 
     """Add all options for edit card command"""
@@ -678,6 +708,7 @@ def main():
     parser_edit_card.add_argument('id', metavar='id', help='card id')
     parser_edit_card.add_argument('-n', '--name', metavar='name', help='card name')
     parser_edit_card.add_argument('-d', '--description', metavar='description', help='card description')
+    parser_edit_card.add_argument('--if-name', metavar='name', help='only edit if current card name is this one')
     parser_edit_card.set_defaults(func=edit_card)
 
     """Add all options for edit secret command"""
@@ -714,7 +745,7 @@ def main():
 
     """Add all options for add secret command"""
     parser_add_secret = subparsers.add_parser('add-secret', help='Add new secret to a card')
-    add_secret_subparsers = parser_add_secret.add_subparsers(dest='command')
+    add_secret_subparsers = parser_add_secret.add_subparsers(dest='secret_type')
     add_secret_subparsers.required = True
 
     """Add all options for add secret note command"""
@@ -766,6 +797,21 @@ def main():
     parser_delete_workspace.set_defaults(func=delete_workspace)
 
     """Parse command arguments"""
-    args = parser.parse_args()
-
-    args.func(args)
+    argv = sys.argv[1:]
+    for index, arg in enumerate(argv[:-1]):
+        # A bare --profile-stats must not take the command name as its file
+        if arg == '--profile-stats' and argv[index + 1] in subparsers.choices:
+            argv[index] = '--profile-stats='
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        tracer.enable()
+    try:
+        with tracer.span(args.command, 'command'):
+            if args.profile_stats == None:
+                args.func(args)
+            else:
+                run_profiled(args)
+    finally:
+        if args.trace:
+            tracer.save(args.trace)
@@ -0,0 +1,209 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2017 Adrián López Tejedor <adrianlzt@gmail.com>
+#                  Óscar García Amor <ogarcia@connectical.com>
+#
+# Distributed under terms of the GNU GPLv3 license.
+
+"""
+Readers of files exported by other password managers
+
+Every reader is a generator that reads a file while it is consumed and
+yields entries as dicts with the following keys:
+    - vault: name of the vault
+    - card: name of the card
+    - name: secret name
+    - type: secret type (100: Note, 200: Password, 300: File)
+    - data: dict with url, username, password and note
+    - file: attached file opened, with a name (only in type 300)
+    - uuid: ID of the entry in the file, to resume imports (can be None)
+"""
+
+from vaultcli.jsonreader import JSONReader
+
+from getpass import getpass
+from io import BytesIO, TextIOWrapper
+from zipfile import ZipFile, is_zipfile
+
+import csv
+
+try:
+    from pykeepass import PyKeePass
+except ImportError:
+    PyKeePass = None
+
+# Names used for entries without folder
+DEFAULT_VAULT = 'Imported'
+DEFAULT_CARD = 'General'
+
+def split_path(path):
+    """
+    Returns vault and card names for a folder path
+
+    First folder is the vault and the rest are joined with dots as card, as
+    Vaultier only has two levels.
+
+    :param path: list of folder names
+    :rtype: tuple
+    """
+    path = [name.replace('/', '_') for name in path if name]
+    if not path:
+        return DEFAULT_VAULT, DEFAULT_CARD
+    return path[0], '.'.join(path[1:]) if len(path) > 1 else DEFAULT_CARD
+
+def entry(path, name, url=None, username=None, password=None, note=None, file=None, uuid=None):
+    """Returns a normalized entry"""
+    vault, card = split_path(path)
+    if file:
+        secret_type = 300
+    elif password or username or url:
+        secret_type = 200
+    else:
+        secret_type = 100
+    return {
+            'vault': vault,
+            'card': card,
+            'name': name.replace('/', '_') if name else 'Unnamed',
+            'type': secret_type,
+            'data': {'url': url or '', 'username': username or '', 'password': password or '', 'note': note or ''},
+            'file': file,
+            'uuid': uuid
+           }
+
+def memory_file(name, data):
+    """Returns data as a file object with name, as needed by upload_file"""
+    file = BytesIO(data)
+    file.name = name
+    return file
+
+def open_file(file_name):
+    try:
+        return open(file_name, 'r', encoding='utf-8', newline='')
+    except Exception as e:
+        err = 'vaultcli cannot read file.\n{0}'.format(e)
+        raise SystemExit(err)
+
+def read_csv(file_name, password=None):
+    """
+    Read a CSV file
+
+    First row must have the column names. Known columns are vault, card,
+    name, url, username, password and note (all of them optional). Entries
+    without vault or card are stored in default ones.
+    """
+    with open_file(file_name) as file:
+        for row in csv.DictReader(file):
+            path = [row.get('vault') or DEFAULT_VAULT, row.get('card') or DEFAULT_CARD]
+            yield entry(path, row.get('name'), row.get('url'), row.get('username'), row.get('password'), row.get('note'))
+
+def read_bitwarden(file_name, password=None):
+    """
+    Read an unencrypted Bitwarden JSON export
+
+    Folder path is mapped to vault and card. Logins are stored as password
+    secrets and the rest of items as notes, with their fields in the note.
+    """
+    with open_file(file_name) as file:
+        data = JSONReader(file).read_object([('items', ('folders',))])
+        if data.get('encrypted'):
+            err = 'Encrypted Bitwarden exports are not supported, export as unencrypted JSON'
+            raise SystemExit(err)
+        folders = {folder['id']: folder['name'].split('/') for folder in data.get('folders', [])}
+        for item in data.get('items', []):
+            path = folders.get(item.get('folderId'), [])
+            login = item.get('login')
+            if item.get('type') == 1 and login:
+                uris = login.get('uris') or []
+                url = uris[0].get('uri') if uris else None
+                yield entry(path, item.get('name'), url, login.get('username'), login.get('password'), item.get('notes'), uuid=item.get('id'))
+            else:
+                # Cards and identities have no place in Vaultier secrets
+                fields = item.get('card') or item.get('identity') or {}
+                lines = ['{}: {}'.format(key, value) for key, value in fields.items() if value]
+                if item.get('notes'):
+                    lines.append(item['notes'])
+                yield entry(path, item.get('name'), note='\n'.join(lines), uuid=item.get('id'))
+
+def read_1password(file_name, password=None):
+    """
+    Read a 1Password 1PUX export (or its export.data file)
+
+    1Password vault is mapped to vault and the first tag of every item to
+    card. Documents are stored as file secrets.
+    """
+    archive = None
+    try:
+        if is_zipfile(file_name):
+            archive = ZipFile(file_name)
+            file = TextIOWrapper(archive.open('export.data'), encoding='utf-8')
+        else:
+            file = open_file(file_name)
+    except SystemExit:
+        raise
+    except Exception as e:
+        err = 'vaultcli cannot read file.\n{0}'.format(e)
+        raise SystemExit(err)
+    with file:
+        data = JSONReader(file).read_object([('accounts', ()), ('vaults', ()), ('items', ('attrs',))])
+        for account in data.get('accounts', []):
+            for vault in account.get('vaults', []):
+                vault_name = vault.get('attrs', {}).get('name')
+                for item in vault.get('items', []):
+                    if item.get('state') == 'archived':
+                        continue
+                    overview = item.get('overview', {})
+                    details = item.get('details', {})
+                    fields = {field.get('designation'): field.get('value') for field in details.get('loginFields', [])}
+                    tags = overview.get('tags') or []
+                    path = [vault_name] + (tags[0].split('/') if tags else [])
+                    document = details.get('documentAttributes')
+                    attached_file = None
+                    if document and archive:
+                        file_data = archive.read('files/{}__{}'.format(document['documentId'], document['fileName']))
+                        attached_file = memory_file(document['fileName'], file_data)
+                    yield entry(path, overview.get('title'), overview.get('url'), fields.get('username'),
+                                fields.get('password') or details.get('password'), details.get('notesPlain'), attached_file, item.get('uuid'))
+    if archive:
+        archive.close()
+
+def read_keepass(file_name, password=None):
+    """
+    Read a KeePass kdbx file (needs pykeepass)
+
+    First level group is mapped to vault and the rest to card. Every
+    attached file is stored as a file secret named after its entry.
+    """
+    if PyKeePass == None:
+        err = 'KeePass format needs pykeepass, install it with \'pip install pykeepass\''
+        raise SystemExit(err)
+    if password == None:
+        password = getpass('KeePass password: ')
+    try:
+        keepass = PyKeePass(file_name, password=password)
+    except Exception as e:
+        err = 'vaultcli cannot read file.\n{0}'.format(e)
+        raise SystemExit(err)
+    for keepass_entry in keepass.entries:
+        path = []
+        group = keepass_entry.group
+        while group != None and not group.is_root_group:
+            path.insert(0, group.name)
+            group = group.parentgroup
+        uuid = str(keepass_entry.uuid) if keepass_entry.uuid else None
+        url = keepass_entry.url.strip() if keepass_entry.url else None
+        keepass_secret = entry(path, keepass_entry.title or keepass_entry.username, url, keepass_entry.username,
+                               keepass_entry.password, keepass_entry.notes, uuid=uuid)
+        yield keepass_secret
+        for attachment in keepass_entry.attachments:
+            yield entry(path, '{} - {}'.format(keepass_secret['name'], attachment.filename),
+                        file=memory_file(attachment.filename, attachment.data),
+                        uuid='{}/{}'.format(uuid, attachment.filename) if uuid else None)
+
+READERS = {
+        'csv': read_csv,
+        'bitwarden': read_bitwarden,
+        '1password': read_1password,
+        'keepass': read_keepass
+          }
@@ -7,19 +7,85 @@
 #
 # Distributed under terms of the GNU GPLv3 license.
 
+import json
+
+class Encrypted(object):
+    """Encrypted value of a secret field, not decrypted yet"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
 class Secret(object):
     """
-    Class representing a Card
+    Class representing a Secret
+
+    When a cypher is given, data and blobMeta hold the encrypted values and
+    each one is decrypted the first time it is read. Assigning them stores
+    the plain value as is.
+
+    Encrypted values are kept wrapped in the field itself, so a secret can be
+    read from several threads: each one sees either the encrypted or the
+    decrypted value, never a decrypted value marked as encrypted.
     """
-    def __init__(self, id, type, name, data, blobMeta, card, workspaceKey=None):
+    __slots__ = ('id', 'type', 'name', 'card', 'workspaceKey', 'cypher', '_data', '_blobMeta')
+
+    def __init__(self, id, type, name, data, blobMeta, card, workspaceKey=None, cypher=None):
         self.id = id
         self.type = type
         self.name = name
-        self.data = data
-        self.blobMeta = blobMeta
+        self._data = data
+        self._blobMeta = blobMeta
         self.card = card
+        self.set_cypher(cypher, workspaceKey)
+
+    def set_cypher(self, cypher, workspaceKey):
+        """
+        Mark current data and blobMeta as encrypted
+
+        :param cypher: Cypher able to decrypt the workspace key
+        :param workspaceKey: key of the workspace that contains the secret
+        """
+        self.cypher = cypher
         self.workspaceKey = workspaceKey
+        if cypher:
+            for field in ('_data', '_blobMeta'):
+                value = getattr(self, field)
+                if value and not isinstance(value, Encrypted):
+                    setattr(self, field, Encrypted(value))
+
+    def decrypted(self, field):
+        """Returns a field decrypting it on first access"""
+        value = getattr(self, field)
+        if isinstance(value, Encrypted):
+            # Threads reading it at the same time may decrypt it twice, all
+            # of them get the same value
+            value = json.loads(self.cypher.decrypt(self.workspaceKey, value.value))
+            setattr(self, field, value)
+        return value
+
+    @property
+    def data(self):
+        return self.decrypted('_data')
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def blobMeta(self):
+        return self.decrypted('_blobMeta')
+
+    @blobMeta.setter
+    def blobMeta(self, value):
+        self._blobMeta = value
+
+    def __eq__(self, other):
+        return isinstance(other, Secret) and self.id == other.id
+
+    def __hash__(self):
+        return hash((Secret, self.id))
 
-    def from_json(json_obj):
-        secret = Secret(json_obj['id'], json_obj['type'], json_obj['name'], json_obj['data'], json_obj['blob_meta'], json_obj['card'])
+    def from_json(json_obj, workspaceKey=None, cypher=None):
+        secret = Secret(json_obj['id'], json_obj['type'], json_obj['name'], json_obj['data'], json_obj['blob_meta'], json_obj['card'], workspaceKey, cypher)
         return secret
@@ -0,0 +1,86 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2017 Adrián López Tejedor <adrianlzt@gmail.com>
+#                  Óscar García Amor <ogarcia@connectical.com>
+#
+# Distributed under terms of the GNU GPLv3 license.
+
+from contextlib import contextmanager
+
+import json
+import os
+import threading
+import time
+
+class Tracer(object):
+    """
+    Class for record a timeline of spans in Chrome trace event format
+
+    Tracer is disabled until enable is called, and then spans of every
+    thread are recorded. Saved file can be opened with Perfetto or
+    chrome://tracing.
+    """
+    def __init__(self):
+        self.events = None
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def enable(self):
+        self.events = []
+        self.threads = {}
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """
+        Record the time spent in a block
+
+        :param name: span name
+        :param category: span category (http, crypto, io, auth...)
+        :param args: extra data shown with the span, the yielded dict can be
+            updated inside the block to add more
+        """
+        if self.events == None:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            thread = threading.current_thread()
+            event = {
+                    'name': name,
+                    'cat': category,
+                    'ph': 'X',
+                    'ts': round((start - self.start) * 1000000, 1),
+                    'dur': round((end - start) * 1000000, 1),
+                    'pid': os.getpid(),
+                    'tid': thread.ident,
+                    'args': args
+                    }
+            with self.lock:
+                self.events.append(event)
+                self.threads[thread.ident] = thread.name
+
+    def save(self, file_name):
+        """
+        Write recorded spans to a JSON file
+
+        :param file_name: output file name
+        """
+        with self.lock:
+            events = list(self.events or [])
+            threads = dict(self.threads)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}} for tid, name in threads.items()]
+        try:
+            with open(file_name, 'w') as file:
+                json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, file)
+        except Exception as e:
+            err = 'vaultcli cannot write file.\n{0}'.format(e)
+            raise SystemExit(err)
+
+tracer = Tracer()
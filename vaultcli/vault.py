@@ -11,6 +11,8 @@ class Vault(object):
     """
     Class representing a Vault
     """
+    __slots__ = ('id', 'slug', 'name', 'description', 'color', 'workspace')
+
     def __init__(self, id, slug, name, description, color, workspace):
         self.id = id
         self.slug = slug
@@ -19,6 +21,12 @@ class Vault(object):
         self.color = color
         self.workspace = workspace
 
+    def __eq__(self, other):
+        return isinstance(other, Vault) and self.id == other.id
+
+    def __hash__(self):
+        return hash((Vault, self.id))
+
     def from_json(json_obj):
         vault = Vault(json_obj['id'], json_obj['slug'], json_obj['name'], json_obj['description'], json_obj['color'], json_obj['workspace'])
         return vault
@@ -9,33 +9,34 @@
 
 from colorama import init, Fore
 from tabulate import tabulate
-from treelib import Tree
 
 import sys
 
 # Initialize colorama
 init(strip=not sys.stdout.isatty())
 
-def print_tree(lst):
-    # Add subfunction to use recursion
-    def add_elements(lst, parent='root', lvl=0):
-        if lvl == 0:
-            # root level, create firs element of list
-            tree.create_node(lst[0], parent)
-        else:
-            tree.create_node(lst[0], lst[0], parent=parent)
-            # not at root level change parent
-            parent = lst[0]
-        for element in lst[1]:
-            if type(element) is list:
-                # recursion!!!
-                add_elements(element, parent, lvl + 1)
-            else:
-                tree.create_node(element, element, parent=parent)
+def print_tree(root, get_children, file=None):
+    """
+    Print a tree while it is being crawled
 
-    tree = Tree()
-    add_elements(lst)
-    tree.show()
+    Every branch is printed as soon as it is reached, so the first lines
+    appear before the rest of the tree has been fetched and only the
+    siblings along the current path are held in memory. Nodes are printed
+    as 'name: id', so entities with the same name never collide.
+
+    :param root: root object of the tree (only its name is printed)
+    :param get_children: function that returns the children of an object
+    :param file: where to print the tree (default stdout)
+    """
+    def print_children(node, prefix=''):
+        children = sorted(get_children(node), key=lambda child: '{}: {}'.format(child.name, child.id))
+        for index, child in enumerate(children):
+            last = index == len(children) - 1
+            print('{}{}{}: {}'.format(prefix, '└── ' if last else '├── ', child.name, child.id), file=file, flush=True)
+            print_children(child, prefix + ('    ' if last else '│   '))
+
+    print(root.name, file=file, flush=True)
+    print_children(root)
 
 def print_workspaces(workspaces):
     ws_table = []
@@ -43,6 +44,15 @@ def print_workspaces(workspaces):
          ws_table.append([workspace.id, workspace.name, workspace.description])
     print (tabulate(ws_table, headers=['ID', 'Name', 'Description'], tablefmt="rst"))
 
+def print_profiles_workspaces(workspaces):
+    """
+    :param workspaces: list of (profile, workspace) tuples
+    """
+    ws_table = []
+    for profile, workspace in workspaces:
+         ws_table.append([profile, workspace.id, workspace.name, workspace.description])
+    print (tabulate(ws_table, headers=['Profile', 'ID', 'Name', 'Description'], tablefmt="rst"))
+
 def print_vaults(vaults):
     v_table = []
     colors = {
@@ -93,3 +103,12 @@ def print_secret(secret):
     if secret.data and 'note' in secret.data:
         print ('Note:')
         print (secret.data['note'])
+
+def print_sync_plan(plan):
+    actions = ['create', 'update', 'delete']
+    kinds = ['workspace', 'vault', 'card', 'secret']
+    p_table = []
+    for kind in kinds:
+        counts = [len([operation for operation in plan if operation[0] == action and operation[1] == kind]) for action in actions]
+        p_table.append([kind.capitalize()] + counts)
+    print (tabulate(p_table, headers=['Type', 'Create', 'Update', 'Delete'], tablefmt="rst"))
@@ -11,6 +11,8 @@ class Workspace(object):
     """
     Class representing a Workspace
     """
+    __slots__ = ('id', 'slug', 'name', 'description', 'workspaceKey')
+
     def __init__(self, id, slug, name, description, workspaceKey):
         self.id = id
         self.slug = slug
@@ -18,6 +20,12 @@ class Workspace(object):
         self.description = description
         self.workspaceKey = workspaceKey
 
+    def __eq__(self, other):
+        return isinstance(other, Workspace) and self.id == other.id
+
+    def __hash__(self):
+        return hash((Workspace, self.id))
+
     def from_json(json_obj):
         workspace = Workspace(json_obj['id'], json_obj['slug'], json_obj['name'], json_obj['description'], json_obj['membership']['workspace_key'])
         return workspace